@@ -1,10 +1,14 @@
 import signal
-import sys
-import time
+import stat
 import threading
-from pathlib import Path
+import time
+import queue
 import concurrent.futures
+import functools
 import os
+from typing import List, Optional
+
+from sqlalchemy import update
 
 from res_loader.config import config
 from res_loader.db import Database, Resource,ResourceStatus,ResourceType
@@ -12,196 +16,399 @@ from res_loader.file_watcher import FileWatcher
 from res_loader.logger import logger
 from res_loader.utils.video import VideoProcessor
 from res_loader.utils.audio import AudioProcessor
+from res_loader.utils.file import FileUtils
+
+
+# 音视频资源类型, 由媒体线程串行处理
+MEDIA_TYPES = (ResourceType.AUDIO, ResourceType.VIDEO)
+
+
+@functools.lru_cache(maxsize=1)
+def get_audio_processor() -> AudioProcessor:
+    """获取共享的音频处理器, 首次调用时才加载 Whisper 模型"""
+    # 配置已与默认值深度合并, 各项必然存在
+    whisper_conf = config.get("whisper")
+    logger.debug(f"whisper_conf: {whisper_conf}")
+    device = whisper_conf["device"]
+    # 未显式指定计算类型时按设备选择, GPU 上使用 int8_float16 走张量核心
+    compute_type = whisper_conf["compute_type"] \
+        or whisper_conf["compute_type_by_device"].get(device, "int8")
+    return AudioProcessor(
+        model_size_or_path=whisper_conf["model_size_or_path"],
+        device=device,
+        compute_type=compute_type,
+        cpu_threads=whisper_conf["cpu_threads"] or max(1, (os.cpu_count() or 1) // 2),
+        num_workers=whisper_conf["num_workers"],
+        draft=whisper_conf["draft"]
+    )
+
+
+@functools.lru_cache(maxsize=1)
+def get_video_processor() -> VideoProcessor:
+    """获取共享的视频处理器"""
+    return VideoProcessor(config.get("ffmpeg_path"), workers=config.get("ffmpeg_workers"))
 
 
 class ResourcePreProcessor:
-    def __init__(self, db: Database):
+    # 一轮处理出错后, 重新处理交还的资源前等待的秒数
+    ERROR_BACKOFF_SECONDS = 5
+    # 队列空闲时重新查询 PENDING 资源的间隔(秒), 兜底其他进程写入或未经通知的待处理资源
+    PENDING_RESCAN_SECONDS = 30
+
+    def __init__(self, db: Database, max_workers: Optional[int] = None):
         self.db = db
-        self._audio_processor: AudioProcessor = None
-        self._video_processor: VideoProcessor = None
+        # 非音视频资源以文件读取为主, 读取期间会释放 GIL, 线程数按 IO 密集型任务配置
+        if max_workers is None:
+            max_workers = config.get("other_workers") or min(32, (os.cpu_count() or 1) + 4)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        # 视频抽取的音频输出目录, 启动时读取并创建一次
+        self.tmp_audio_dir: str = config.get("tmp_audio_dir", "tmp_audio")
+        os.makedirs(self.tmp_audio_dir, exist_ok=True)
+        # 新资源入库后由数据库推送资源ID, 工作线程阻塞等待而不是定时轮询
+        self.media_q: queue.Queue = queue.Queue()
+        self.other_q: queue.Queue = queue.Queue()
+        self.db.watch_pending(self.media_q, MEDIA_TYPES)
+        self.db.watch_pending(self.other_q, [t for t in ResourceType if t not in MEDIA_TYPES])
 
     @property
-    def audio_processor(self):
-        if self._audio_processor is None:
-            whisper_conf = config.get("whisper") or {}
-            logger.debug(f"whisper_conf: {whisper_conf}")
-            self._audio_processor = AudioProcessor(
-                model_size_or_path=whisper_conf.get("model_size_or_path", "base"),
-                device=whisper_conf.get("device", "cpu"),
-                compute_type=whisper_conf.get("compute_type", "int8")
-            )
-        return self._audio_processor
+    def audio_processor(self) -> AudioProcessor:
+        return get_audio_processor()
     
     @property
-    def video_processor(self):
-        if self._video_processor is None:
-            self._video_processor = VideoProcessor(config.get("ffmpeg_path"))
-        return self._video_processor
-
-    def do_process_video(self,resource: Resource, session):
-        # 获取音频输出目录
-        audio_dir = config.get("tmp_audio_dir", "tmp_audio")
-        os.makedirs(audio_dir, exist_ok=True)
-        
-        # 生成音频文件路径
-        audio_filename = f"{Path(resource.path).stem}.mp3"
-        audio_path = os.path.join(audio_dir, audio_filename)
+    def video_processor(self) -> VideoProcessor:
+        return get_video_processor()
 
-        if not self.video_processor.video_to_audio(resource.path, audio_path):
-            logger.error(f"视频转换为音频失败: {resource.path}")
-            resource.status = ResourceStatus.FAILED
-            session.commit()
-            return
-        resource.converted_path = audio_path
-        self.do_process_audio(resource, session)
-
-    def do_process_audio(self, resource: Resource, session):
-        audio_path = resource.audio_path()
-        if not audio_path:
-            logger.error(f"音频文件不存在: {resource.path}")
-            resource.status = ResourceStatus.FAILED
-            session.commit()
-            return
-        
-        # 使用 Whisper 将音频转换为文本
-        text = self.audio_processor.audio_to_text(audio_path)
-        if text is None:
-            logger.error(f"音频转文本失败: {audio_path}")
-            resource.status = ResourceStatus.FAILED
-            session.commit()
-            return
+    @staticmethod
+    def _result(resource: Resource, status: ResourceStatus, **values) -> dict:
+        """构造一条处理结果, 由工作线程在一轮结束后批量写回数据库"""
+        return {"id": resource.id, "status": status, **values}
+
+    def _failed(self, resource: Resource, error: Exception) -> dict:
+        """单个资源处理出错时的失败结果, 只影响该资源, 同批次其他资源照常处理"""
+        logger.error(f"处理资源失败 {resource.path}: {error}")
+        return self._result(resource, ResourceStatus.FAILED, error_message=str(error))
+
+    def _extracted_audio_path(self, resource: Resource) -> str:
+        """视频抽取出的音频文件路径, 带上资源ID避免同名视频并发抽取时互相覆盖"""
+        stem = os.path.splitext(os.path.basename(resource.path))[0]
+        audio_filename = f"{resource.id}_{stem}.mp3"
+        return os.path.join(self.tmp_audio_dir, audio_filename)
+
+    def process_media_batch(self, resources: list, stop_event: threading.Event) -> List[dict]:
+        """
+        批量处理音视频资源: 先并发完成视频抽取音频, 再批量转写
         
-        # 保存转换后的文本
-        resource.content = text
-        resource.status = ResourceStatus.PRE_PROCESSED
-        session.commit()
-        logger.info(f"音频转文本成功: {audio_path} {text[:100]}...")
+        单个资源的检查或抽取出错只将该资源标记为失败；模型加载失败等影响整批的错误向上抛出，
+        由工作线程交还本批资源稍后重试。
+        """
+        results = []
+        batch = []
+        checked = []
+        for resource in resources:
+            if stop_event.is_set():
+                # 未处理的资源交还给下一次运行
+                results.append(self._result(resource, ResourceStatus.PENDING))
+                continue
+            logger.info(f"处理加载资源: {resource.path}")
+            try:
+                st = self._check_resource_file(resource)
+            except Exception as e:
+                results.append(self._failed(resource, e))
+                continue
+            if st is None:
+                results.append(self._result(resource, ResourceStatus.FAILED))
+                continue
+            checked.append(resource)
+
+        # 并发执行视频抽取音频
+        videos = [r for r in checked if r.resource_type == ResourceType.VIDEO]
+        extracted = {}
+        if videos:
+            jobs = [(r.path, self._extracted_audio_path(r)) for r in videos]
+            for resource, (_, audio_path), ok in zip(videos, jobs, self.video_processor.video_to_audio_many(jobs)):
+                if ok:
+                    extracted[resource.id] = audio_path
+                else:
+                    logger.error(f"视频转换为音频失败: {resource.path}")
+
+        for resource in checked:
+            audio_path = resource.audio_path()
+            if resource.resource_type == ResourceType.VIDEO:
+                audio_path = extracted.get(resource.id)
+                if audio_path is None:
+                    results.append(self._result(resource, ResourceStatus.FAILED))
+                    continue
+            if not audio_path:
+                logger.error(f"音频文件不存在: {resource.path}")
+                results.append(self._result(resource, ResourceStatus.FAILED))
+                continue
+            batch.append((resource, audio_path))
+        if not batch:
+            return results
+
+        # 使用 Whisper 批量将音频转换为文本
+        texts = self.audio_processor.audio_to_text_batch([audio_path for _, audio_path in batch])
+        for (resource, audio_path), text in zip(batch, texts):
+            converted = {"converted_path": audio_path} if resource.resource_type == ResourceType.VIDEO else {}
+            if text is None:
+                logger.error(f"音频转文本失败: {audio_path}")
+                results.append(self._result(resource, ResourceStatus.FAILED, **converted))
+                continue
+            logger.info(f"音频转文本成功: {audio_path} {text[:100]}...")
+            results.append(self._result(resource, ResourceStatus.PRE_PROCESSED, content=text, **converted))
+        return results
+
+    def _check_resource_file(self, resource: Resource) -> Optional[os.stat_result]:
+        """检查资源文件是否存在且为普通文件, 通过时返回文件的 stat 结果供后续复用"""
+        try:
+            st = os.stat(resource.path)
+        except FileNotFoundError:
+            logger.error(f"文件不存在: {resource.path}")
+            return None
+        except OSError as e:
+            # 路径中间不是目录、符号链接循环、无权限等, 与文件不存在一样视为失败
+            logger.error(f"无法访问文件 {resource.path}: {e}")
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            logger.error(f"路径不是文件: {resource.path}")
+            return None
+        return st
+
+    def _handle_text(self, resource: Resource, st: os.stat_result) -> dict:
+        content = FileUtils.read_text(resource.path, encoding="utf-8", size=st.st_size)
+        return self._result(resource, ResourceStatus.PRE_PROCESSED, content=content)
+
+    def _handle_noop(self, resource: Resource, st: os.stat_result) -> dict:
+        """暂无预处理步骤的类型, 直接标记为预处理完成"""
+        return self._result(resource, ResourceStatus.PRE_PROCESSED)
+
+    def _handle_unsupported(self, resource: Resource, st: os.stat_result) -> dict:
+        logger.error(f"尚未支持的文件类型: {resource.path}")
+        return self._result(resource, ResourceStatus.FAILED, error_message="尚未支持的文件类型")
+
+    # 资源类型 -> 预处理函数, 音视频资源由媒体线程经 process_media_batch 批量处理, 不在此分派
+    _HANDLERS = {
+        ResourceType.TEXT: _handle_text,
+        ResourceType.MARKDOWN: _handle_text,
+        **dict.fromkeys((
+            ResourceType.IMAGE,
+            ResourceType.PDF,
+            ResourceType.WORD,
+            ResourceType.PPT,
+            ResourceType.EXCEL,
+            ResourceType.CSV,
+        ), _handle_noop),
+    }
 
-    def pre_process_resource(self, resource: Resource, session):
+    def pre_process_resource(self, resource: Resource) -> dict:
+        """预处理单个资源, 返回待写回数据库的处理结果"""
         logger.info(f"处理加载资源: {resource.path}")
-        # 获取待处理文件
-        file_path = Path(resource.path)
-        if not file_path.exists():
-            logger.error(f"文件不存在: {file_path}")
-            resource.status = ResourceStatus.FAILED
-            session.commit()
+        # 获取待处理文件, 一次 stat 同时完成存在性检查与大小获取
+        st = self._check_resource_file(resource)
+        if st is None:
+            return self._result(resource, ResourceStatus.FAILED)
+        # 按文件类型分派
+        cls = type(self)
+        handler = cls._HANDLERS.get(resource.resource_type, cls._handle_unsupported)
+        return handler(self, resource, st)
+
+    def _save_results(self, session, results: List[dict]):
+        """
+        将一轮处理结果通过一次批量 UPDATE 写回数据库
+        
+        批量写回失败时逐条写回, 无法写入的结果改为将该资源标记为失败, 避免一条记录阻塞整批；
+        全部无法写入（如数据库不可用）时抛出异常, 由工作线程交还本批资源。
+        """
+        if not results:
             return
-        if not file_path.is_file():
-            logger.error(f"路径不是文件: {file_path}")
-            resource.status = ResourceStatus.FAILED
+        try:
+            session.execute(update(Resource), results)
             session.commit()
             return
-        # 获取文件类型
-        resource_type = resource.resource_type
-        if resource_type == ResourceType.TEXT \
-            or resource_type == ResourceType.MARKDOWN:
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read()
-                resource.content = content
-                resource.status = ResourceStatus.PRE_PROCESSED
+        except Exception as e:
+            session.rollback()
+            logger.error(f"批量写回处理结果失败, 改为逐条写回: {e}")
+
+        saved = 0
+        error: Optional[Exception] = None
+        for result in results:
+            try:
+                session.execute(update(Resource), [result])
                 session.commit()
-        elif resource_type == ResourceType.AUDIO:
-            self.do_process_audio(resource, session)
-        elif resource_type == ResourceType.VIDEO:
-            self.do_process_video(resource, session)
-        elif resource_type == ResourceType.IMAGE \
-            or resource_type == ResourceType.PDF \
-            or resource_type == ResourceType.WORD \
-            or resource_type == ResourceType.PPT \
-            or resource_type == ResourceType.EXCEL \
-            or resource_type == ResourceType.CSV:
-            resource.status = ResourceStatus.PRE_PROCESSED
-            session.commit()
-        else:
-            resource.status = ResourceStatus.FAILED
-            resource.error_message = "尚未支持的文件类型"
-            session.commit()
-            logger.error(f"尚未支持的文件类型: {resource.path}")
+                saved += 1
+                continue
+            except Exception as e:
+                session.rollback()
+                error = e
+                logger.error(f"写回处理结果失败 id={result['id']}: {e}")
+            try:
+                session.execute(update(Resource), [{
+                    "id": result["id"],
+                    "status": ResourceStatus.FAILED,
+                    "error_message": f"写回处理结果失败: {error}",
+                }])
+                session.commit()
+                saved += 1
+            except Exception as e:
+                session.rollback()
+                logger.error(f"标记资源失败状态失败 id={result['id']}: {e}")
+        if not saved:
+            raise error
+
+    def _enqueue_pending(self, pending_q: queue.Queue, media: bool):
+        """将数据库中的待处理资源放入队列, 启动时及队列空闲时定期调用"""
+        session = self.db.Session()
+        try:
+            type_filter = Resource.resource_type.in_(MEDIA_TYPES)
+            rows = session.query(Resource.id).filter(
+                Resource.status == ResourceStatus.PENDING
+            ).filter(
+                type_filter if media else ~type_filter
+            ).all()
+            for (resource_id,) in rows:
+                pending_q.put(resource_id)
+        finally:
+            self.db.Session.remove()
+
+    def _release_claimed(self, pending_q: queue.Queue, resource_ids: list, resources: List[Resource],
+                         stop_event: threading.Event):
+        """
+        处理出错后交还本轮资源: 已认领的置回 PENDING 并由数据库重新通知, 认领失败时将取出的ID放回队列。
+        稍作等待再继续, 避免模型加载失败等持续性错误下反复重试。
+        """
+        try:
+            if resources:
+                self.db.release_resources(r.id for r in resources)
+            else:
+                for resource_id in resource_ids:
+                    pending_q.put(resource_id)
+        except Exception as e:
+            logger.error(f"交还资源失败: {e}")
+        stop_event.wait(self.ERROR_BACKOFF_SECONDS)
+
+    def _next_pending(self, pending_q: queue.Queue, media: bool, last_rescan: float) -> tuple:
+        """
+        取出一批待处理资源ID; 等待超时且距上次查询超过 PENDING_RESCAN_SECONDS 时重新查询数据库
+        
+        Returns:
+            tuple: (资源ID列表, 上次查询数据库的时间)
+        """
+        resource_ids = self._drain_pending(pending_q)
+        if not resource_ids and time.monotonic() - last_rescan >= self.PENDING_RESCAN_SECONDS:
+            last_rescan = time.monotonic()
+            try:
+                self._enqueue_pending(pending_q, media=media)
+            except Exception as e:
+                logger.error(f"查询待处理资源失败: {e}")
+        return resource_ids, last_rescan
+
+    @staticmethod
+    def _drain_pending(pending_q: queue.Queue, max_items: int = 10, timeout: float = 1) -> list:
+        """阻塞等待待处理资源ID, 并批量取出至多 max_items 个"""
+        try:
+            resource_id = pending_q.get(timeout=timeout)
+        except queue.Empty:
+            return []
+        resource_ids = []
+        while resource_id is not None:
+            resource_ids.append(resource_id)
+            if len(resource_ids) >= max_items:
+                break
+            try:
+                resource_id = pending_q.get_nowait()
+            except queue.Empty:
+                break
+        return resource_ids
 
-    
     def process_media_resources(self, stop_event: threading.Event):
         """处理音视频资源的线程函数"""
-        while not stop_event.is_set():
-            try:
-                session = self.db.Session()
-                # 获取待处理的音视频资源
-                resources = session.query(Resource).filter(
-                    Resource.status == ResourceStatus.PENDING
-                ).filter(
-                    Resource.resource_type.in_([ResourceType.AUDIO, ResourceType.VIDEO])
-                ).limit(10).all()
-                
-                for resource in resources:
-                    if stop_event.is_set():
-                        break
-                    self.pre_process_resource(resource, session)
+        self._enqueue_pending(self.media_q, media=True)
+        last_rescan = time.monotonic()
+        # 工作线程在整个生命周期内复用同一个会话, 每批次提交
+        session = self.db.worker_session()
+        try:
+            while not stop_event.is_set():
+                resource_ids, last_rescan = self._next_pending(self.media_q, True, last_rescan)
+                if not resource_ids:
+                    continue
+                resources = []
+                try:
+                    # 认领待处理的音视频资源
+                    resources = self.db.claim_pending_resources(session, resource_ids)
                     
-                session.close()
-            except Exception as e:
-                logger.error(f"处理音视频资源时出错: {e}")
-                if 'session' in locals():
-                    session.close()
-            
-            # 休眠一段时间再检查新资源
-            if not stop_event.is_set():
-                stop_event.wait(timeout=3)
+                    results = self.process_media_batch(resources, stop_event)
+                    self._save_results(session, results)
+                except Exception as e:
+                    session.rollback()
+                    logger.error(f"处理音视频资源时出错: {e}")
+                    self._release_claimed(self.media_q, resource_ids, resources, stop_event)
+        finally:
+            self.db.release_worker_session()
 
-    def process_other_resources(self, stop_event: threading.Event, max_workers: int = 4):
+    def _safe_pre_process(self, resource: Resource) -> dict:
+        """预处理单个资源, 异常时返回失败结果, 避免中断同批次其他资源"""
+        try:
+            return self.pre_process_resource(resource)
+        except Exception as e:
+            return self._failed(resource, e)
+
+    def process_other_resources(self, stop_event: threading.Event):
         """处理非音视频资源的线程池函数"""
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        self._enqueue_pending(self.other_q, media=False)
+        last_rescan = time.monotonic()
+        # 线程池中的任务只读取已加载的资源属性, 不共享会话
+        session = self.db.worker_session()
+        try:
             while not stop_event.is_set():
+                resource_ids, last_rescan = self._next_pending(self.other_q, False, last_rescan)
+                if not resource_ids:
+                    continue
+                resources = []
                 try:
-                    session = self.db.Session()
-                    # 获取待处理的非音视频资源，排除已失败和已完成的资源
-                    resources = session.query(Resource).filter(
-                        Resource.status == ResourceStatus.PENDING
-                    ).filter(
-                        ~Resource.resource_type.in_([ResourceType.AUDIO, ResourceType.VIDEO])
-                    ).limit(10).all()
+                    # 认领待处理的非音视频资源，已被其他工作进程认领的资源会被跳过
+                    resources = self.db.claim_pending_resources(session, resource_ids)
                     
                     if resources:
                         logger.info(f"发现 {len(resources)} 个待处理资源")
                         for resource in resources:
                             logger.info(f"资源信息: id={resource.id}, name={resource.name}, type={resource.resource_type}, path={resource.path}, status={resource.status}")
                     
-                    # 提交任务到线程池
-                    futures = []
-                    for resource in resources:
-                        if stop_event.is_set():
-                            break
-                        futures.append(executor.submit(self.pre_process_resource, resource, session))
-                    
-                    # 等待所有任务完成
-                    concurrent.futures.wait(futures)
-                    session.close()
-                        
+                    if stop_event.is_set():
+                        # 未处理的资源交还给下一次运行
+                        results = [self._result(r, ResourceStatus.PENDING) for r in resources]
+                    else:
+                        # 由常驻线程池并行处理, 汇总结果后一次性写回
+                        results = list(self._executor.map(self._safe_pre_process, resources))
+                    self._save_results(session, results)
                 except Exception as e:
+                    session.rollback()
                     logger.error(f"处理其他资源时出错: {e}")
-                    if 'session' in locals():
-                        session.close()
-                
-                # 休眠一段时间再检查新资源
-                if not stop_event.is_set():
-                    stop_event.wait(timeout=3)
+                    self._release_claimed(self.other_q, resource_ids, resources, stop_event)
+        finally:
+            self.db.release_worker_session()
+
+    def close(self):
+        """关闭常驻线程池, 等待已提交的任务完成"""
+        self._executor.shutdown(wait=True)
 
     def run(self):
         # 创建停止事件
         stop_event = threading.Event()
-        session = self.db.Session()
-        # 获取待处理的非音视频资源，排除已失败和已完成的资源
-        
+
+        # 重置上次异常退出时遗留的处理中资源
+        self.db.reset_processing_resources()
+
         # 获取监视目录配置
         watch_dir = config.get("watch_dir", "watch")
         
         # 创建文件监视器
         watcher = FileWatcher(watch_dir, self.db)
         
-        # 设置信号处理
+        # 设置信号处理: 只设置停止事件, 清理统一由主线程的 finally 完成,
+        # 避免在信号上下文中打断工作线程正在进行的提交
         def signal_handler(sig, frame):
-            logger.info("正在停止文件监视器...")
-            watcher.stop()
-            self.db.close()
-            sys.exit(0)
+            logger.info("收到停止信号, 正在停止...")
+            stop_event.set()
         
         signal.signal(signal.SIGINT, signal_handler)
         signal.signal(signal.SIGTERM, signal_handler)
@@ -230,16 +437,20 @@ class ResourcePreProcessor:
             watcher.start()
             logger.info("文件监视器已启动，按 Ctrl+C 停止")
             
-            # 保持程序运行
-            while True:
-                time.sleep(3)
+            # 保持程序运行直到收到停止信号, 带超时等待以便 Windows 下及时响应 Ctrl+C
+            while not stop_event.wait(timeout=1):
+                pass
         except Exception as e:
             logger.error(f"发生错误: {e}")
         finally:
             stop_event.set()
+            # 唤醒阻塞在队列上的工作线程
+            self.media_q.put(None)
+            self.other_q.put(None)
             media_thread.join()
             logger.info("媒体处理线程已停止")
             other_thread.join()
+            self.close()
             logger.info("其他处理线程已停止")
             watcher.stop()
             logger.info("文件监视器已停止")
@@ -1,9 +1,25 @@
 from pathlib import Path
 from typing import Optional, Dict, Any
+import copy
 import json
 import os
 from res_loader.logger import logger
 
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时回退到标准库 json
+    orjson = None
+
+
+def _deep_merge(dst: Dict[str, Any], src: Dict[str, Any]) -> Dict[str, Any]:
+    """将 src 递归合并到 dst 中, 嵌套字典逐键覆盖而不是整体替换"""
+    for key, value in src.items():
+        if isinstance(value, dict) and isinstance(dst.get(key), dict):
+            _deep_merge(dst[key], value)
+        else:
+            dst[key] = value
+    return dst
+
 
 class Config:
     def __init__(self, config_path:str = "config.json"):
@@ -11,14 +27,27 @@ class Config:
         self.config: Dict[str, Any] = {}
         self.default_config: dict = {
             "ffmpeg_path": "bin/ffmpeg.exe",
+            "ffmpeg_workers": None,  # 同时运行的 ffmpeg 进程数, 为空时取 CPU 核数的一半
             "temp_dir": "temp",
             "output_dir": "output",
             "tmp_audio_dir": "tmp_audio",
             "watch_dir": "test_data/",
+            "hash_algo": "md5",  # 文件去重哈希: md5, sha256, blake3(需安装 blake3), xxh3(需安装 xxhash, 最快); 切换后已入库的文件会被视为新文件
+            "hash_xattr_cache": False,  # 将文件哈希保存到文件的扩展属性, 重启后未变化的文件无需重新计算(仅 Linux)
+            "other_workers": None,  # 非音视频资源处理线程数, 为空时取 min(32, CPU核数 + 4)
             "whisper": {
+                # 可预先量化模型后填写路径, 例如:
+                # ct2-transformers-converter --model openai/whisper-base --output_dir models/whisper-base-ct2-int8 --quantization int8
                 "model_size_or_path": "base",  # 可选: tiny, base, small, medium, large, 或者模型路径models/faster-whisper-large-v3-turbo-ct2
                 "device": "cpu",       # 可选: cpu, cuda
-                "compute_type": "int8" # 可选: int8, float16, float32
+                "compute_type": None,  # 可选: int8, int8_float16, int8_bfloat16, float16, bfloat16, float32; 为空时按设备选择
+                "compute_type_by_device": {
+                    "cpu": "int8",
+                    "cuda": "int8_float16"
+                },
+                "cpu_threads": None,   # CPU 推理线程数, 为空时取 CPU 核数的一半, 给其他资源处理线程留出余量
+                "num_workers": 1,      # 并行转写的模型工作者数
+                "draft": False         # 草稿模式: 贪心解码(beam_size=1, temperature=0), 更快且结果确定
             },
             "log": {
                 "dir": "logs",
@@ -44,19 +73,19 @@ class Config:
         if config_path and os.path.exists(config_path):
             self.load_config()
         else:
-            self.config = self.default_config.copy()
+            self.config = copy.deepcopy(self.default_config)
     
     def load_config(self) -> None:
         """从配置文件加载配置"""
         try:
-            with open(self.config_path, 'r', encoding='utf-8') as f:
-                loaded_config = json.load(f) or {}
-                # 合并默认配置和加载的配置
-                self.config = {**self.default_config, **loaded_config}
+            raw = Path(self.config_path).read_bytes()
+            loaded_config = (orjson.loads(raw) if orjson else json.loads(raw)) or {}
+            # 深度合并默认配置和加载的配置, 未配置的嵌套项保留默认值
+            self.config = _deep_merge(copy.deepcopy(self.default_config), loaded_config)
             logger.debug(f"加载配置文件成功: {self.config_path}")
         except Exception as e:
             logger.error(f"加载配置文件失败: {e}")
-            self.config = self.default_config.copy()
+            self.config = copy.deepcopy(self.default_config)
     
     def get(self, key: str, default: Any = None) -> Any:
         """获取配置项，如果不存在则返回默认值"""
@@ -73,9 +102,14 @@ class Config:
             return
             
         try:
-            os.makedirs(os.path.dirname(self.config_path), exist_ok=True)
-            with open(self.config_path, 'w', encoding='utf-8') as f:
-                json.dump(self.config, f, indent=4, ensure_ascii=False)
+            config_dir = os.path.dirname(self.config_path)
+            if config_dir:
+                os.makedirs(config_dir, exist_ok=True)
+            if orjson:
+                data = orjson.dumps(self.config, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+            else:
+                data = json.dumps(self.config, indent=4, ensure_ascii=False).encode('utf-8')
+            Path(self.config_path).write_bytes(data)
         except Exception as e:
             logger.error(f"保存配置文件失败: {e}") 
 
@@ -83,7 +117,7 @@ class Config:
         """获取数据库配置
         
         Returns:
-            dict: 数据库配置字典，包含数据库类型和对应的连接参数
+            dict: 数据库配置字典，包含数据库类型 db_type 和对应的连接参数，可直接用于构造 Database
         """
         db_conf: dict = self.get("database", {})
         db_type: str = db_conf.get("type") or "sqlite"
@@ -93,7 +127,7 @@ class Config:
             db_type = "sqlite"
             
         return {
-            "type": db_type,
+            "db_type": db_type,
             **db_conf.get(db_type, {})
         }
 
@@ -1,10 +1,13 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, Enum
+from sqlalchemy import create_engine, event, inspect, text, Column, BigInteger, Integer, String, DateTime, Text, Enum, Index, update, and_, or_
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.orm import Session, sessionmaker, scoped_session
 from sqlalchemy.pool import QueuePool
 from datetime import datetime
 import enum
-from typing import Optional, List, Dict, Any
+import queue
+from contextlib import contextmanager
+import threading
+from typing import Optional, List, Dict, Any, Iterable, Tuple
 from pathlib import Path
 import os
 from res_loader.logger import logger
@@ -27,6 +30,7 @@ class ResourceType(enum.Enum):
 # 定义资源状态枚举
 class ResourceStatus(enum.Enum):
     PENDING = "pending"      # 等待处理
+    PROCESSING = "processing"  # 已被工作线程认领, 处理中
     PRE_PROCESSED = "pre_processed"  # 预处理完成
     FAILED = "failed"       # 处理失败
     DELETED = "deleted"     # 已删除
@@ -37,12 +41,22 @@ Base = declarative_base()
 class Resource(Base):
     """资源表"""
     __tablename__ = 'resources'
+    __table_args__ = (
+        Index('ix_resources_path', 'path'),
+        Index('ix_resources_md5', 'md5'),
+        # 按状态+类型筛选待处理资源
+        Index('ix_status_type', 'status', 'resource_type'),
+        # list_resources 按 (created_at, id) 倒序做键集分页
+        Index('ix_created_id', 'created_at', 'id'),
+    )
     
     id = Column(Integer, primary_key=True)
     name = Column(String(255), nullable=False)
     resource_type = Column(Enum(ResourceType), default=ResourceType.UNKNOWN, nullable=False)
     path = Column(String(512), default="", nullable=False)
-    md5 = Column(String(32), default="", nullable=False)
+    md5 = Column(String(64), default="", nullable=False)  # 文件哈希, 默认MD5, 可配置为 sha256/blake3
+    size = Column(BigInteger)  # 计算哈希时的文件大小, 与 mtime_ns 一起判断文件是否变化
+    mtime_ns = Column(BigInteger)  # 计算哈希时的文件修改时间(纳秒)
     content = Column(Text, default="")
     converted_path = Column(String(512))
     status = Column(Enum(ResourceStatus), default=ResourceStatus.PENDING, nullable=False)
@@ -71,24 +85,41 @@ class Database:
         """
         self.db_type = db_type.lower()
         self.engine = self._create_engine(**kwargs)
-        self.Session = scoped_session(sessionmaker(bind=self.engine))
+        # 提交后不过期已加载的属性, 资源对象可安全地交给线程池中的其他线程只读访问
+        self._session_factory = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.Session = scoped_session(self._session_factory)
+        # 常驻线程的长期会话: 线程ID -> 会话, 避免每次操作都归还/取出连接
+        self._worker_sessions: Dict[int, Session] = {}
+        self._worker_lock = threading.Lock()
+        # 待处理资源通知队列, 新资源入库后推送资源ID, 替代工作线程轮询
+        self._pending_watchers: List[tuple] = []
+        self._pending_lock = threading.Lock()
+        # 线程内的事务嵌套深度与待发送的通知
+        self._local = threading.local()
         
         # 创建表
         Base.metadata.create_all(self.engine)
+        self._add_missing_columns()
+        # 已存在的表不会由 create_all 补建索引, 逐个检查创建
+        for index in Resource.__table__.indexes:
+            index.create(self.engine, checkfirst=True)
     
     def _create_engine(self, **kwargs) -> Any:
         """创建数据库引擎"""
         if self.db_type == "sqlite":
             db_path = kwargs.get('db_path', 'data/res_loader.db')
             os.makedirs(os.path.dirname(db_path), exist_ok=True)
-            return create_engine(
+            engine = create_engine(
                 f'sqlite:///{db_path}',
                 poolclass=QueuePool,
                 pool_size=5,
                 max_overflow=10,
                 pool_timeout=30,
-                pool_recycle=1800
+                pool_recycle=1800,
+                query_cache_size=1200
             )
+            event.listen(engine, "connect", self._set_sqlite_pragmas)
+            return engine
         elif self.db_type == "mysql":
             return create_engine(
                 f"mysql+pymysql://{kwargs['user']}:{kwargs['password']}@{kwargs['host']}:{kwargs['port']}/{kwargs['database']}",
@@ -96,13 +127,129 @@ class Database:
                 pool_size=5,
                 max_overflow=10,
                 pool_timeout=30,
-                pool_recycle=1800
+                pool_recycle=1800,
+                pool_pre_ping=True,  # 取用连接前检测, 避免使用已被服务端断开的连接
+                query_cache_size=1200
             )
         else:
             raise ValueError(f"不支持的数据库类型: {self.db_type}")
     
+    def _add_missing_columns(self) -> None:
+        """为旧版本创建的表补充新增的可空列, create_all 不会修改已存在的表"""
+        table = Resource.__table__
+        existing = {column["name"] for column in inspect(self.engine).get_columns(table.name)}
+        missing = [column for column in table.columns if column.name not in existing]
+        if not missing:
+            return
+        with self.engine.begin() as conn:
+            for column in missing:
+                column_type = column.type.compile(dialect=self.engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                logger.info("数据表 %s 新增列: %s", table.name, column.name)
+    
+    @staticmethod
+    def _set_sqlite_pragmas(dbapi_conn, connection_record) -> None:
+        """SQLite 连接参数: WAL 模式允许读写并发, synchronous=NORMAL 减少每次提交的 fsync"""
+        cursor = dbapi_conn.cursor()
+        try:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+            cursor.execute("PRAGMA mmap_size=268435456")
+            cursor.execute("PRAGMA cache_size=-65536")  # 64MB 页缓存
+        finally:
+            cursor.close()
+    
+    @contextmanager
+    def session_scope(self):
+        """
+        事务上下文: 成功时提交，异常时回滚，结束后释放线程内的会话。
+        
+        嵌套使用时复用外层事务，由最外层统一提交，调用方可将多次操作合并为一个事务：
+        
+            with db.session_scope():
+                db.add_resource(...)
+                db.update_resource(...)
+        
+        当前线程持有 worker_session 时复用该会话，结束时只提交不释放。
+        """
+        session = self._worker_sessions.get(threading.get_ident())
+        owned = session is None
+        if owned:
+            session = self.Session()
+        if getattr(self._local, "depth", 0):
+            self._local.depth += 1
+            try:
+                yield session
+            finally:
+                self._local.depth -= 1
+            return
+
+        self._local.depth = 1
+        self._local.notify = []
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            self._local.notify = []
+            raise
+        finally:
+            self._local.depth = 0
+            if owned:
+                self.Session.remove()
+        # 事务提交后再通知工作线程, 保证其能读到新记录
+        notify, self._local.notify = self._local.notify, []
+        for resource_id, resource_type in notify:
+            self._notify_pending(resource_id, resource_type)
+
+    def worker_session(self) -> Session:
+        """
+        获取当前线程的长期会话，供常驻线程在整个生命周期内复用
+        
+        调用方须在批次边界显式 commit()，出错时 rollback()，线程退出前调用 release_worker_session()。
+        """
+        thread_id = threading.get_ident()
+        session = self._worker_sessions.get(thread_id)
+        if session is None:
+            session = self._session_factory()
+            with self._worker_lock:
+                self._worker_sessions[thread_id] = session
+        return session
+    
+    def release_worker_session(self) -> None:
+        """关闭当前线程的长期会话"""
+        with self._worker_lock:
+            session = self._worker_sessions.pop(threading.get_ident(), None)
+        if session is not None:
+            session.close()
+    
+    def watch_pending(self, pending_q: queue.Queue, resource_types: Optional[Iterable[ResourceType]] = None) -> None:
+        """
+        注册待处理资源通知队列
+        
+        Args:
+            pending_q: 接收待处理资源ID的队列
+            resource_types: 关注的资源类型，为None时接收所有类型
+        """
+        types = frozenset(resource_types) if resource_types is not None else None
+        with self._pending_lock:
+            self._pending_watchers.append((pending_q, types))
+    
+    def _notify_pending(self, resource_id: int, resource_type: ResourceType) -> None:
+        """通知关注该类型的队列有新的待处理资源，处于事务中时延迟到提交之后"""
+        if getattr(self._local, "depth", 0):
+            self._local.notify.append((resource_id, resource_type))
+            return
+        with self._pending_lock:
+            watchers = list(self._pending_watchers)
+        for pending_q, types in watchers:
+            if types is None or resource_type in types:
+                pending_q.put(resource_id)
+    
     def add_resource(self, name: str, resource_type: ResourceType, path: str, md5: str, 
-                    converted_path: Optional[str] = None) -> Resource:
+                    converted_path: Optional[str] = None, size: Optional[int] = None,
+                    mtime_ns: Optional[int] = None) -> Resource:
         """
         添加资源记录。如果path已存在，则更新该记录而不是添加新记录。
         
@@ -112,6 +259,8 @@ class Database:
             path: 资源路径
             md5: 资源MD5值
             converted_path: 转换后的资源路径
+            size: 文件大小
+            mtime_ns: 文件修改时间(纳秒)
             
         Returns:
             Resource: 添加或更新后的资源记录
@@ -119,128 +268,468 @@ class Database:
         Raises:
             Exception: 添加或更新失败时抛出异常
         """
-        session = self.Session()
         try:
-            # 检查是否已存在相同路径的资源
-            existing_resource = session.query(Resource).filter_by(path=path).first()
+            with self.session_scope() as session:
+                # 检查是否已存在相同路径的资源
+                resource = session.query(Resource).filter_by(path=path).first()
+                
+                if resource:
+                    # 更新现有记录
+                    resource.name = name
+                    resource.resource_type = resource_type
+                    if converted_path:
+                        resource.converted_path = converted_path
+                    if md5 and resource.md5 != md5:
+                        # 如果MD5发生变化，重置相关字段
+                        resource.converted_path = ""
+                        resource.content = None
+                        resource.error_message = None
+                        resource.status = ResourceStatus.PENDING
+                    resource.md5 = md5
+                    resource.size = size
+                    resource.mtime_ns = mtime_ns
+                    session.flush()
+                    logger.info("更新资源记录: %s", path)
+                else:
+                    # 添加新记录
+                    resource = Resource(
+                        name=name,
+                        resource_type=resource_type,
+                        path=path,
+                        md5=md5,
+                        converted_path=converted_path,
+                        size=size,
+                        mtime_ns=mtime_ns,
+                        status=ResourceStatus.PENDING
+                    )
+                    session.add(resource)
+                    session.flush()
+                    logger.info("添加新资源记录: %s", path)
+                if resource.status == ResourceStatus.PENDING:
+                    self._notify_pending(resource.id, resource.resource_type)
+                return resource
+        except Exception as e:
+            logger.error("添加/更新资源记录失败: %s", e)
+            raise
+    
+    def bulk_upsert_resources(self, pending: List[Dict[str, Any]], chunk_size: int = 500,
+                              path_index: Optional[Dict[str, int]] = None) -> int:
+        """
+        批量添加资源记录，用于目录扫描。语义与逐个调用 add_resource 一致：
+        MD5 已存在的文件跳过（同一路径时仅刷新文件大小与修改时间）；路径已存在时更新该记录并重置处理状态，
+        否则插入新记录。
+        
+        Args:
+            pending: 资源字典列表，包含 name, resource_type, path, md5, 可选 size, mtime_ns
+            chunk_size: 每批查询/写入的记录数
+            path_index: 不为None时，写入的记录以 路径 -> 资源ID 填入其中
             
-            if existing_resource:
-                # 更新现有记录
-                existing_resource.name = name
-                existing_resource.resource_type = resource_type
-                if converted_path:
-                    existing_resource.converted_path = converted_path
-                if md5 and existing_resource.md5 != md5:
-                    # 如果MD5发生变化，重置相关字段
-                    existing_resource.converted_path = ""
-                    existing_resource.content = None
-                    existing_resource.error_message = None
-                    existing_resource.status = ResourceStatus.PENDING
-                existing_resource.md5 = md5
-                session.commit()
-                logger.info(f"更新资源记录: {path}")
-                return existing_resource
-            else:
-                # 添加新记录
-                resource = Resource(
-                    name=name,
-                    resource_type=resource_type,
-                    path=path,
-                    md5=md5,
-                    converted_path=converted_path,
-                    status=ResourceStatus.PENDING
-                )
-                session.add(resource)
+        Returns:
+            int: 新增或更新的记录数
+        """
+        # 同一批次内 MD5 相同的文件只保留第一个
+        unique: Dict[str, Dict[str, Any]] = {}
+        for item in pending:
+            unique.setdefault(item["md5"], item)
+        items = list(unique.values())
+        if not items:
+            return 0
+        # 首次扫描空表时不存在需要跳过或更新的记录, SQLite 直接走原生批量插入
+        if self.db_type == "sqlite" and not getattr(self._local, "depth", 0) and self._is_empty():
+            return self.bulk_insert_raw(items, path_index=path_index)
+
+        count = 0
+        # 路径 -> 资源ID, 事务提交后才写入 path_index, 回滚时不会留下无效的ID
+        indexed: Dict[str, int] = {}
+        try:
+            with self.session_scope() as session:
+                for start in range(0, len(items), chunk_size):
+                    chunk = items[start:start + chunk_size]
+                    known_md5 = {
+                        md5: (resource_id, path)
+                        for md5, resource_id, path in session.query(Resource.md5, Resource.id, Resource.path).filter(
+                            Resource.md5.in_([item["md5"] for item in chunk])
+                        )
+                    }
+                    # 内容未变的文件只记录当前的 stat, 下次扫描可跳过哈希计算
+                    touched = [
+                        {"id": known_md5[item["md5"]][0], "size": item.get("size"), "mtime_ns": item.get("mtime_ns")}
+                        for item in chunk
+                        if item["md5"] in known_md5 and known_md5[item["md5"]][1] == item["path"]
+                    ]
+                    if touched:
+                        session.bulk_update_mappings(Resource, touched)
+                    chunk = [item for item in chunk if item["md5"] not in known_md5]
+                    if not chunk:
+                        continue
+                    existing = {
+                        path: resource_id
+                        for path, resource_id in session.query(Resource.path, Resource.id).filter(
+                            Resource.path.in_([item["path"] for item in chunk])
+                        )
+                    }
+
+                    to_insert = []
+                    to_update = []
+                    for item in chunk:
+                        row = {
+                            "name": item["name"],
+                            "resource_type": item["resource_type"],
+                            "path": item["path"],
+                            "md5": item["md5"],
+                            "size": item.get("size"),
+                            "mtime_ns": item.get("mtime_ns"),
+                            "status": ResourceStatus.PENDING,
+                        }
+                        if item["path"] in existing:
+                            resource_id = existing[item["path"]]
+                            # 路径已存在且MD5发生变化，重置相关字段
+                            row.update(
+                                id=resource_id,
+                                converted_path="",
+                                content=None,
+                                error_message=None,
+                            )
+                            to_update.append(row)
+                        else:
+                            to_insert.append(row)
+
+                    if to_insert:
+                        session.bulk_insert_mappings(Resource, to_insert, return_defaults=True)
+                    if to_update:
+                        session.bulk_update_mappings(Resource, to_update)
+                    for row in to_insert + to_update:
+                        self._notify_pending(row["id"], row["resource_type"])
+                        indexed[row["path"]] = row["id"]
+                    count += len(to_insert) + len(to_update)
+        except Exception as e:
+            logger.error("批量添加资源记录失败: %s", e)
+            raise
+        if path_index is not None:
+            path_index.update(indexed)
+
+        logger.info("批量添加/更新资源记录: %s 个", count)
+        return count
+
+    def _is_empty(self) -> bool:
+        """资源表是否为空"""
+        with self.session_scope() as session:
+            return session.query(Resource.id).limit(1).first() is None
+
+    def bulk_insert_raw(self, items: List[Dict[str, Any]], path_index: Optional[Dict[str, int]] = None) -> int:
+        """
+        绕过 ORM 工作单元，以 DB-API executemany 在一个事务中插入资源记录，用于 SQLite 首次全量入库。
+        调用方需保证路径与 MD5 均不存在于表中。
+        
+        Args:
+            items: 资源字典列表，包含 name, resource_type, path, md5, 可选 size, mtime_ns
+            path_index: 不为None时，写入的记录以 路径 -> 资源ID 填入其中
+            
+        Returns:
+            int: 插入的记录数
+        """
+        table = Resource.__table__
+        columns = ["name", "resource_type", "path", "md5", "size", "mtime_ns", "status", "created_at", "updated_at"]
+        # 使用列类型的绑定处理器转换枚举与时间, 存储格式与 ORM 写入的一致
+        dialect = self.engine.dialect
+        processors = [table.c[name].type.bind_processor(dialect) for name in columns]
+        now = datetime.now()
+        rows = []
+        for item in items:
+            values = (item["name"], item["resource_type"], item["path"], item["md5"],
+                      item.get("size"), item.get("mtime_ns"), ResourceStatus.PENDING, now, now)
+            rows.append(tuple(
+                process(value) if process else value for process, value in zip(processors, values)
+            ))
+        sql = "INSERT INTO {} ({}) VALUES ({})".format(table.name, ", ".join(columns), ", ".join("?" * len(columns)))
+
+        conn = self.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.executemany(sql, rows)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+        except Exception as e:
+            logger.error("批量插入资源记录失败: %s", e)
+            raise
+        finally:
+            conn.close()
+
+        # 插入后读回ID, 通知工作线程
+        with self.session_scope() as session:
+            inserted = session.query(Resource.id, Resource.path, Resource.resource_type).filter(
+                Resource.status == ResourceStatus.PENDING
+            ).all()
+        for resource_id, path, resource_type in inserted:
+            self._notify_pending(resource_id, resource_type)
+            if path_index is not None:
+                path_index[path] = resource_id
+        logger.info("批量插入资源记录: %s 个", len(rows))
+        return len(rows)
+
+    def claim_pending_resources(self, session, resource_ids: Iterable[int], limit: int = 10) -> List[Resource]:
+        """
+        认领待处理资源: 在同一事务中将 PENDING 置为 PROCESSING，避免多个工作进程重复处理
+        
+        MySQL 使用 SELECT ... FOR UPDATE SKIP LOCKED；SQLite 不支持行锁，
+        使用带状态条件的 UPDATE ... RETURNING 原子认领。
+        
+        Args:
+            session: 调用方持有的数据库会话
+            resource_ids: 候选资源ID
+            limit: 单次最多认领的数量
+            
+        Returns:
+            List[Resource]: 本次成功认领的资源
+        """
+        resource_ids = list(resource_ids)[:limit]
+        if not resource_ids:
+            return []
+        try:
+            if self.db_type == "sqlite":
+                claimed_ids = session.execute(
+                    update(Resource)
+                    .where(Resource.id.in_(resource_ids))
+                    .where(Resource.status == ResourceStatus.PENDING)
+                    .values(status=ResourceStatus.PROCESSING)
+                    .returning(Resource.id)
+                ).scalars().all()
                 session.commit()
-                logger.info(f"添加新资源记录: {path}")
-                return resource
-                
+                if not claimed_ids:
+                    return []
+                return session.query(Resource).filter(Resource.id.in_(claimed_ids)).all()
+
+            resources = session.query(Resource).filter(
+                Resource.id.in_(resource_ids)
+            ).filter(
+                Resource.status == ResourceStatus.PENDING
+            ).with_for_update(skip_locked=True).limit(limit).all()
+            for resource in resources:
+                resource.status = ResourceStatus.PROCESSING
+            session.commit()
+            return resources
         except Exception as e:
             session.rollback()
-            logger.error(f"添加/更新资源记录失败: {e}")
+            logger.error("认领待处理资源失败: %s", e)
+            raise
+
+    def release_resources(self, resource_ids: Iterable[int]) -> int:
+        """
+        将已认领但未能完成处理的资源由 PROCESSING 交还为 PENDING，并重新通知工作线程
+        
+        Args:
+            resource_ids: 资源ID
+            
+        Returns:
+            int: 被交还的资源数量
+        """
+        resource_ids = list(resource_ids)
+        if not resource_ids:
+            return 0
+        try:
+            with self.session_scope() as session:
+                released = session.query(Resource.id, Resource.resource_type).filter(
+                    Resource.id.in_(resource_ids),
+                    Resource.status == ResourceStatus.PROCESSING,
+                ).all()
+                session.query(Resource).filter(
+                    Resource.id.in_([resource_id for resource_id, _ in released]),
+                    Resource.status == ResourceStatus.PROCESSING,
+                ).update({Resource.status: ResourceStatus.PENDING}, synchronize_session=False)
+                for resource_id, resource_type in released:
+                    self._notify_pending(resource_id, resource_type)
+        except Exception as e:
+            logger.error("交还处理中资源失败: %s", e)
+            raise
+        if released:
+            logger.info("交还处理中资源: %s 个", len(released))
+        return len(released)
+
+    def reset_processing_resources(self) -> int:
+        """
+        将处理中断遗留的 PROCESSING 资源重置为 PENDING，启动时调用
+        
+        Returns:
+            int: 被重置的资源数量
+        """
+        try:
+            with self.session_scope() as session:
+                count = session.query(Resource).filter(
+                    Resource.status == ResourceStatus.PROCESSING
+                ).update({Resource.status: ResourceStatus.PENDING}, synchronize_session=False)
+        except Exception as e:
+            logger.error("重置处理中资源失败: %s", e)
+            raise
+        if count:
+            logger.info("重置中断的处理中资源: %s 个", count)
+        return count
+
+    def mark_deleted_by_path(self, path: str) -> int:
+        """
+        将指定路径的资源标记为已删除
+        
+        Args:
+            path: 资源路径
+            
+        Returns:
+            int: 被更新的记录数
+        """
+        try:
+            with self.session_scope() as session:
+                return session.query(Resource).filter(Resource.path == path).update({
+                    Resource.status: ResourceStatus.DELETED,
+                    Resource.error_message: "文件已被删除"
+                }, synchronize_session=False)
+        except Exception as e:
+            logger.error("标记资源删除失败: %s", e)
+            raise
+    
+    def mark_deleted(self, resource_id: int) -> int:
+        """
+        按主键将资源标记为已删除，不读取记录
+        
+        Args:
+            resource_id: 资源ID
+            
+        Returns:
+            int: 被更新的记录数
+        """
+        try:
+            with self.session_scope() as session:
+                return session.query(Resource).filter(Resource.id == resource_id).update({
+                    Resource.status: ResourceStatus.DELETED,
+                    Resource.error_message: "文件已被删除"
+                }, synchronize_session=False)
+        except Exception as e:
+            logger.error("标记资源删除失败: %s", e)
             raise
-        finally:
-            session.close()
     
     def get_resource(self, resource_id: int) -> Optional[Resource]:
         """获取资源记录"""
-        session = self.Session()
-        try:
+        with self.session_scope() as session:
             return session.query(Resource).filter_by(id=resource_id).first()
-        finally:
-            session.close()
+    
+    def get_resource_by_path(self, path: str) -> Optional[Resource]:
+        """通过路径获取资源记录"""
+        with self.session_scope() as session:
+            return session.query(Resource).filter_by(path=path).first()
+    
+    def get_stats_by_path(self, paths: Iterable[str],
+                          chunk_size: int = 500) -> Dict[str, Tuple[int, Optional[int], Optional[int]]]:
+        """
+        批量获取未删除资源记录的ID与文件 stat，用于扫描时跳过未变化的文件
+        
+        Args:
+            paths: 资源路径
+            chunk_size: 每批查询的路径数
+            
+        Returns:
+            Dict[str, Tuple[int, Optional[int], Optional[int]]]: 路径 -> (id, size, mtime_ns)
+        """
+        paths = list(paths)
+        stats: Dict[str, Tuple[int, Optional[int], Optional[int]]] = {}
+        with self.session_scope() as session:
+            for start in range(0, len(paths), chunk_size):
+                rows = session.query(Resource.path, Resource.id, Resource.size, Resource.mtime_ns).filter(
+                    Resource.path.in_(paths[start:start + chunk_size]),
+                    Resource.status != ResourceStatus.DELETED,
+                )
+                for path, resource_id, size, mtime_ns in rows:
+                    stats[path] = (resource_id, size, mtime_ns)
+        return stats
     
     def get_resource_by_md5(self, md5: str) -> Optional[Resource]:
         """通过MD5获取资源记录"""
-        session = self.Session()
-        try:
+        with self.session_scope() as session:
             return session.query(Resource).filter_by(md5=md5).first()
-        finally:
-            session.close()
     
     def update_resource(self, resource_id: int, **kwargs) -> Optional[Resource]:
         """更新资源记录"""
-        session = self.Session()
         try:
-            resource = session.query(Resource).filter_by(id=resource_id).first()
-            if resource:
-                for key, value in kwargs.items():
-                    if hasattr(resource, key):
-                        setattr(resource, key, value)
-                session.commit()
+            with self.session_scope() as session:
+                resource = session.query(Resource).filter_by(id=resource_id).first()
+                if resource:
+                    for key, value in kwargs.items():
+                        if hasattr(resource, key):
+                            setattr(resource, key, value)
+                    if kwargs.get("status") == ResourceStatus.PENDING:
+                        self._notify_pending(resource.id, resource.resource_type)
                 return resource
-            return None
         except Exception as e:
-            session.rollback()
-            logger.error(f"更新资源记录失败: {e}")
+            logger.error("更新资源记录失败: %s", e)
             raise
-        finally:
-            session.close()
     
     def delete_resource(self, resource_id: int) -> bool:
         """删除资源记录"""
-        session = self.Session()
         try:
-            resource = session.query(Resource).filter_by(id=resource_id).first()
-            if resource:
-                session.delete(resource)
-                session.commit()
-                return True
-            return False
+            with self.session_scope() as session:
+                resource = session.query(Resource).filter_by(id=resource_id).first()
+                if resource:
+                    session.delete(resource)
+                    return True
+                return False
         except Exception as e:
-            session.rollback()
-            logger.error(f"删除资源记录失败: {e}")
+            logger.error("删除资源记录失败: %s", e)
             raise
-        finally:
-            session.close()
     
     def list_resources(self, resource_type: Optional[ResourceType] = None, 
                       status: Optional[ResourceStatus] = None,
-                      limit: int = 100, offset: int = 0) -> List[Resource]:
-        """列出资源记录"""
-        session = self.Session()
-        try:
+                      limit: int = 100, offset: int = 0,
+                      cursor: Optional[Tuple[datetime, int]] = None) -> List[Resource]:
+        """
+        列出资源记录，按创建时间倒序
+        
+        Args:
+            resource_type: 资源类型过滤
+            status: 资源状态过滤
+            limit: 返回数量
+            offset: 已废弃，偏移量越大扫描越多，请改用 cursor
+            cursor: 键集分页游标，传入上一页最后一条记录的 (created_at, id)
+            
+        Returns:
+            List[Resource]: 资源记录列表
+        """
+        with self.session_scope() as session:
             query = session.query(Resource)
             if resource_type:
                 query = query.filter_by(resource_type=resource_type)
             if status:
                 query = query.filter_by(status=status)
-            return query.order_by(Resource.created_at.desc()).offset(offset).limit(limit).all()
-        finally:
-            session.close()
+            if cursor is not None:
+                created_at, resource_id = cursor
+                query = query.filter(or_(
+                    Resource.created_at < created_at,
+                    and_(Resource.created_at == created_at, Resource.id < resource_id)
+                ))
+            query = query.order_by(Resource.created_at.desc(), Resource.id.desc())
+            if offset:
+                query = query.offset(offset)
+            return query.limit(limit).all()
     
-    def get_pending_resources(self, resource_type: Optional[ResourceType] = None, limit: int = 100) -> List[Resource]:
+    def get_pending_resources(self, resource_type: Optional[ResourceType] = None, limit: int = 100,
+                              cursor: Optional[Tuple[datetime, int]] = None) -> List[Resource]:
         """获取待处理的资源"""
-        return self.list_resources(resource_type=resource_type, status=ResourceStatus.PENDING, limit=limit)
+        return self.list_resources(resource_type=resource_type, status=ResourceStatus.PENDING, limit=limit, cursor=cursor)
     
-    def get_failed_resources(self, resource_type: Optional[ResourceType] = None, limit: int = 100) -> List[Resource]:
+    def get_failed_resources(self, resource_type: Optional[ResourceType] = None, limit: int = 100,
+                             cursor: Optional[Tuple[datetime, int]] = None) -> List[Resource]:
         """获取处理失败的资源"""
-        return self.list_resources(resource_type=resource_type, status=ResourceStatus.FAILED, limit=limit)
+        return self.list_resources(resource_type=resource_type, status=ResourceStatus.FAILED, limit=limit, cursor=cursor)
     
     def close(self):
         """关闭数据库连接"""
+        with self._worker_lock:
+            sessions, self._worker_sessions = list(self._worker_sessions.values()), {}
+        for session in sessions:
+            session.close()
         self.Session.remove()
-        self.engine.dispose() 
+        self.engine.dispose()
 
 
 if __name__ == "__main__":
@@ -248,7 +737,7 @@ if __name__ == "__main__":
     if not db_conf:
         logger.error("无法获取数据库配置")
         exit(1)
-    db_conf["type"] = "sqlite"
+    db_conf["db_type"] = "sqlite"
     db_conf["db_path"] = "data/res_loader_test.db"
     db = Database(**db_conf)
     db.update_resource(1, status=ResourceStatus.FAILED, error_message="test error")
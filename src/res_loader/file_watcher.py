@@ -1,15 +1,46 @@
+import concurrent.futures
 import os
+import queue
+import threading
 import time
 from pathlib import Path
-from typing import Optional, Set, Dict, Callable
+from types import MappingProxyType
+from typing import Optional, Set, Dict, Callable, Any, Iterator, List, Mapping, Union
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler, FileCreatedEvent, FileDeletedEvent, FileModifiedEvent
+from watchdog.events import FileSystemEventHandler, FileClosedEvent, FileCreatedEvent, FileDeletedEvent, FileModifiedEvent
 from res_loader.logger import logger
-from res_loader.utils.file import FileUtils
+from res_loader.utils.file import FileStat, FileUtils
 from res_loader.db import Database, Resource, ResourceType, ResourceStatus
 from res_loader.config import config
 
+# 文件扩展名(小写, 不含点号) -> 资源类型, 不在表中的文件不会入库
+EXT_MAP: Mapping[str, ResourceType] = MappingProxyType({
+    'mp4': ResourceType.VIDEO,
+    'avi': ResourceType.VIDEO,
+    'mkv': ResourceType.VIDEO,
+    'mov': ResourceType.VIDEO,
+    'ts': ResourceType.VIDEO,
+    'mp3': ResourceType.AUDIO,
+    'wav': ResourceType.AUDIO,
+    'txt': ResourceType.TEXT,
+    'log': ResourceType.TEXT,
+    'pdf': ResourceType.PDF,
+    'md': ResourceType.MARKDOWN,
+    'doc': ResourceType.WORD,
+    'docx': ResourceType.WORD,
+    'ppt': ResourceType.PPT,
+    'pptx': ResourceType.PPT,
+    'xls': ResourceType.EXCEL,
+    'xlsx': ResourceType.EXCEL,
+    'csv': ResourceType.CSV
+})
+
 class FileWatcher:
+    # 同一路径最后一次事件后静默多久才处理, 编辑器保存时的连串修改事件只处理一次
+    DEBOUNCE_SECONDS = 0.5
+    # 事件合并线程检查到期路径的间隔
+    DRAIN_INTERVAL = 0.1
+    
     def __init__(self, watch_dir: str, db: Database):
         """
         初始化文件监视器
@@ -20,8 +51,13 @@ class FileWatcher:
         """
         self.watch_dir = Path(watch_dir)
         self.db = db
+        # 已入库文件的 路径 -> 资源ID, 删除事件据此直接按主键更新
+        self.path_index: Dict[str, int] = {}
         self.observer = Observer()
         self.handler = FileChangeHandler(self)
+        # 文件事件队列, 由合并线程去重后批量处理, None 表示停止
+        self._events: queue.Queue = queue.Queue()
+        self._drainer: Optional[threading.Thread] = None
         
         # 确保监视目录存在
         os.makedirs(watch_dir, exist_ok=True)
@@ -29,85 +65,219 @@ class FileWatcher:
         # 初始化时扫描目录中的文件
         self._scan_directory()
     
+    @staticmethod
+    def _iter_files(root: str) -> Iterator[FileStat]:
+        """
+        递归遍历目录中的普通文件
+        
+        os.scandir 在读取目录时已得到文件类型，DirEntry.stat() 的结果也会被缓存，
+        相比 os.walk + Path 拼接减少 stat 调用和对象分配。
+        
+        Yields:
+            FileStat: 文件路径、文件名及 stat 信息，后续流程直接复用
+        """
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                                continue
+                            if not entry.is_file():
+                                continue
+                            fs = FileStat.from_entry(entry)
+                        except OSError:
+                            # 遍历期间被删除或无法 stat 的条目跳过, 不影响同目录的其他文件
+                            continue
+                        yield fs
+            except OSError as e:
+                logger.error("读取目录失败 %s: %s", directory, e)
+    
     def _scan_directory(self) -> None:
-        """扫描目录中的所有文件并添加到数据库"""
-        for root, _, files in os.walk(self.watch_dir):
-            for file in files:
-                if not FileUtils.is_write_completed(Path(root) / file):
-                    logger.warning(f"文件未写入完成: {Path(root) / file}, 跳过")
+        """扫描目录中的所有文件并批量添加到数据库"""
+        # 先按扩展名过滤, 不支持的文件无需等待写入完成
+        candidates = [fs for fs in self._iter_files(str(self.watch_dir)) if self.is_supported(fs.name)]
+        
+        # 大小与修改时间均与数据库记录一致的文件视为未变化, 跳过写入检查与哈希计算
+        known = self.db.get_stats_by_path(fs.path for fs in candidates)
+        changed = []
+        for fs in candidates:
+            row = known.get(fs.path)
+            if row is not None:
+                self.path_index[fs.path] = row[0]
+                if row[1:] == (fs.size, fs.mtime_ns):
                     continue
-                file_path = Path(root) / file
-                self._process_file(file_path)
+            changed.append(fs)
+        logger.info("扫描目录 %s: %s 个文件, %s 个未变化", self.watch_dir, len(candidates), len(candidates) - len(changed))
+        
+        # 多线程检查写入状态并计算哈希, 文件读取与哈希计算期间释放 GIL, 磁盘 IO 与计算相互重叠
+        with concurrent.futures.ThreadPoolExecutor(max_workers=FileUtils.io_workers()) as executor:
+            pending = [item for item in executor.map(self._scan_file, changed) if item]
+        try:
+            self.db.bulk_upsert_resources(pending, path_index=self.path_index)
+        except Exception as e:
+            logger.error("扫描目录入库失败 %s: %s", self.watch_dir, e)
+    
+    def _scan_file(self, fs: FileStat) -> Optional[Dict[str, Any]]:
+        """
+        检查并计算单个文件的入库信息, 文件不可用时返回None
+        
+        记录的是扫描时的 stat: 若文件在此之后仍被写入, 下次扫描时 stat 不一致会重新计算哈希,
+        不会出现新 stat 对应旧哈希而漏掉变化的情况。
+        """
+        if not FileUtils.is_write_completed(fs.path):
+            logger.warning("文件未写入完成: %s, 跳过", fs.path)
+            return None
+        file_md5 = FileUtils.get_file_hash(fs.path, config.get("hash_algo", "md5"),
+                                           xattr_cache=config.get("hash_xattr_cache", False))
+        if not file_md5:
+            logger.error("无法获取文件MD5: %s", fs.path)
+            return None
+        return {
+            "name": fs.name,
+            "resource_type": self._get_resource_type(FileUtils.get_file_type(fs.name)),
+            "path": fs.path,
+            "md5": file_md5,
+            "size": fs.size,
+            "mtime_ns": fs.mtime_ns,
+        }
     
-    def _process_file(self, file_path: Path) -> None:
-        """处理单个文件，添加到数据库或更新状态"""
+    def _process_file(self, file_path: Path) -> Optional[int]:
+        """
+        处理单个文件，添加到数据库或更新状态
+        
+        数据库写入在保存点中完成，单个文件出错只回滚该文件，不影响同一事务中的其他文件。
+        
+        Returns:
+            Optional[int]: 该路径对应的资源ID，由调用方在事务提交后写入 path_index
+        """
+        resource_id = None
         try:
+            if not self.is_supported(file_path):
+                logger.debug("不支持的文件类型，跳过: %s", file_path)
+                return None
+            
+            # 大小与修改时间均未变化的文件无需重新计算哈希, 与 _scan_file 一样记录写入检查前的 stat
+            fs = FileStat.from_path(str(file_path))
+            known = self.db.get_resource_by_path(fs.path)
+            if known and known.status != ResourceStatus.DELETED:
+                resource_id = known.id
+                if known.size == fs.size and known.mtime_ns == fs.mtime_ns:
+                    logger.debug("文件未变化，跳过: %s", file_path)
+                    return resource_id
+            
             # 等待文件写入完成
-            if not FileUtils.is_write_completed(str(file_path)):
-                logger.warning(f"文件可能仍在写入中，跳过处理: {file_path}")
-                return
+            if not FileUtils.is_write_completed(fs.path):
+                logger.warning("文件可能仍在写入中，跳过处理: %s", file_path)
+                return resource_id
                 
             # 获取文件信息
-            file_name = file_path.name
-            resource_type = FileUtils.get_file_type(str(file_path))
-            file_md5 = FileUtils.get_file_md5(str(file_path))
+            resource_type = FileUtils.get_file_type(fs.name)
+            file_md5 = FileUtils.get_file_hash(fs.path, config.get("hash_algo", "md5"),
+                                               xattr_cache=config.get("hash_xattr_cache", False))
             
             if not file_md5:
-                logger.error(f"无法获取文件MD5: {file_path}")
-                return
-            
-            # 检查文件是否已在数据库中
-            existing_resource = self.db.get_resource_by_md5(file_md5)
+                logger.error("无法获取文件MD5: %s", file_path)
+                return resource_id
             
-            if not existing_resource:
-                # 添加新记录
-                resource_type_enum = self._get_resource_type(resource_type)
-                self.db.add_resource(
-                    name=file_name,
-                    resource_type=resource_type_enum,
-                    path=str(file_path),
-                    md5=file_md5
-                )
-                logger.info(f"添加新文件记录: {file_path}")
+            # 查询与写入在同一事务的保存点中完成
+            with self.db.session_scope() as session, session.begin_nested():
+                # 检查文件是否已在数据库中
+                existing_resource = self.db.get_resource_by_md5(file_md5)
+                
+                if not existing_resource:
+                    # 添加新记录
+                    resource_type_enum = self._get_resource_type(resource_type)
+                    resource = self.db.add_resource(
+                        name=fs.name,
+                        resource_type=resource_type_enum,
+                        path=fs.path,
+                        md5=file_md5,
+                        size=fs.size,
+                        mtime_ns=fs.mtime_ns
+                    )
+                    resource_id = resource.id
+                    logger.info("添加新文件记录: %s", file_path)
+                elif existing_resource.path == fs.path:
+                    # 内容未变, 仅记录当前 stat
+                    self.db.update_resource(existing_resource.id, size=fs.size, mtime_ns=fs.mtime_ns)
+            return resource_id
                 
         except Exception as e:
-            logger.error(f"处理文件失败 {file_path}: {e}")
+            logger.error("处理文件失败 %s: %s", file_path, e)
+            return None
+    
+    def _drain(self) -> None:
+        """合并文件事件: 路径在静默窗口内的多次事件只保留最后一次, 到期的路径批量处理"""
+        last_seen: Dict[Path, float] = {}
+        stopping = False
+        # 本线程的数据库操作复用同一个长期会话, 每批次提交一次
+        self.db.worker_session()
+        try:
+            while not stopping:
+                try:
+                    file_path = self._events.get(timeout=self.DRAIN_INTERVAL)
+                    while True:
+                        if file_path is None:
+                            stopping = True
+                            break
+                        last_seen[file_path] = time.monotonic()
+                        file_path = self._events.get_nowait()
+                except queue.Empty:
+                    pass
+                
+                now = time.monotonic()
+                due = [path for path, seen in last_seen.items() if now - seen >= self.DEBOUNCE_SECONDS]
+                if due and not stopping:
+                    for path in due:
+                        del last_seen[path]
+                    self._process_batch(due)
+        finally:
+            self.db.release_worker_session()
+    
+    def _process_batch(self, file_paths: List[Path]) -> None:
+        """在同一事务中处理一批文件, 提交成功后再更新 path_index, 避免记录已回滚的资源ID"""
+        indexed: Dict[str, int] = {}
+        try:
+            with self.db.session_scope():
+                for file_path in file_paths:
+                    resource_id = self._process_file(file_path)
+                    if resource_id is not None:
+                        indexed[str(file_path)] = resource_id
+        except Exception as e:
+            logger.error("批量处理文件事件失败: %s", e)
+            return
+        self.path_index.update(indexed)
     
     def _get_resource_type(self, file_type: str) -> ResourceType:
-        """根据文件扩展名获取资源类型"""
-        file_type = file_type.lower()
-        type_mapping = {
-            'mp4': ResourceType.VIDEO,
-            'avi': ResourceType.VIDEO,
-            'mkv': ResourceType.VIDEO,
-            'ts': ResourceType.VIDEO,
-            'mp3': ResourceType.AUDIO,
-            'wav': ResourceType.AUDIO,
-            'txt': ResourceType.TEXT,
-            'log': ResourceType.TEXT,
-            'pdf': ResourceType.PDF,
-            'md': ResourceType.MARKDOWN,
-            'doc': ResourceType.WORD,
-            'docx': ResourceType.WORD,
-            'ppt': ResourceType.PPT,
-            'pptx': ResourceType.PPT,
-            'xls': ResourceType.EXCEL,
-            'xlsx': ResourceType.EXCEL,
-            'csv': ResourceType.CSV
-        }
-        return type_mapping.get(file_type, ResourceType.UNKNOWN)
+        """根据文件扩展名获取资源类型, file_type 为 FileUtils.get_file_type 返回的小写扩展名"""
+        return EXT_MAP.get(file_type, ResourceType.UNKNOWN)
+    
+    def is_supported(self, file_path: Union[str, Path]) -> bool:
+        """文件扩展名是否为支持的资源类型"""
+        return self._get_resource_type(FileUtils.get_file_type(file_path)) != ResourceType.UNKNOWN
     
     def start(self) -> None:
         """开始监视目录"""
+        self._drainer = threading.Thread(target=self._drain, name="FileEventDrainer", daemon=True)
+        self._drainer.start()
         self.observer.schedule(self.handler, str(self.watch_dir), recursive=True)
         self.observer.start()
-        logger.info(f"开始监视目录: {self.watch_dir}")
+        logger.info("开始监视目录: %s", self.watch_dir)
     
     def stop(self) -> None:
         """停止监视目录"""
         self.observer.stop()
         self.observer.join()
-        logger.info(f"停止监视目录: {self.watch_dir}")
+        # 未到期的事件直接丢弃, 下次启动时由目录扫描补齐
+        if self._drainer is not None:
+            self._events.put(None)
+            self._drainer.join()
+            self._drainer = None
+        logger.info("停止监视目录: %s", self.watch_dir)
 
 class FileChangeHandler(FileSystemEventHandler):
     def __init__(self, watcher: FileWatcher):
@@ -116,30 +286,35 @@ class FileChangeHandler(FileSystemEventHandler):
     def on_created(self, event: FileCreatedEvent) -> None:
         """处理文件创建事件"""
         if not event.is_directory:
-            logger.info(f"文件创建事件: {event.src_path}")
+            logger.info("文件创建事件: %s", event.src_path)
             # self.watcher._process_file(Path(event.src_path))
     
     def on_modified(self, event: FileModifiedEvent) -> None:
         """处理文件修改事件"""
-        if not event.is_directory and FileUtils.is_write_completed(Path(event.src_path)):
-            logger.info(f"文件修改事件: {event.src_path}")
-            self.watcher._process_file(Path(event.src_path))
+        # 写入完成检查与入库由合并线程完成, 不阻塞事件分发线程
+        if not event.is_directory and self.watcher.is_supported(event.src_path):
+            logger.info("文件修改事件: %s", event.src_path)
+            self.watcher._events.put(Path(event.src_path))
+    
+    def on_closed(self, event: FileClosedEvent) -> None:
+        """处理写入方关闭文件事件（Linux inotify IN_CLOSE_WRITE），文件已写完无需轮询等待"""
+        if not event.is_directory and self.watcher.is_supported(event.src_path):
+            logger.info("文件关闭事件: %s", event.src_path)
+            FileUtils.mark_write_completed(event.src_path)
+            self.watcher._events.put(Path(event.src_path))
     
     def on_deleted(self, event: FileDeletedEvent) -> None:
         """处理文件删除事件"""
         if not event.is_directory:
             try:
-                # 查找并更新数据库中对应的记录
-                file_path = Path(event.src_path)
-                resources = self.watcher.db.list_resources()
-                for resource in resources:
-                    if Path(resource.path) == file_path:
-                        self.watcher.db.update_resource(
-                            resource.id,
-                            status=ResourceStatus.DELETED,
-                            error_message="文件已被删除"
-                        )
-                        logger.info(f"更新已删除文件状态: {file_path}")
-                        break
+                # 已知文件直接按主键更新, 否则按路径索引更新数据库中对应的记录
+                file_path = str(Path(event.src_path))
+                resource_id = self.watcher.path_index.pop(file_path, None)
+                if resource_id is not None:
+                    updated = self.watcher.db.mark_deleted(resource_id)
+                else:
+                    updated = self.watcher.db.mark_deleted_by_path(file_path)
+                if updated:
+                    logger.info("更新已删除文件状态: %s", file_path)
             except Exception as e:
-                logger.error(f"处理文件删除事件失败 {event.src_path}: {e}") 
\ No newline at end of file
+                logger.error("处理文件删除事件失败 %s: %s", event.src_path, e)
\ No newline at end of file
@@ -1,6 +1,8 @@
+import atexit
 import logging
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
 import os
+import queue
 from pathlib import Path
 from typing import Optional
 import sys
@@ -34,9 +36,16 @@ class Logger:
         # 确保日志目录存在
         os.makedirs(log_dir, exist_ok=True)
         
-        # 设置日志格式
+        # 日志格式中未使用线程/进程信息与调用位置, 关闭采集以减少每条记录的开销
+        logging.logThreads = False
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
+        logging._srcfile = None  # 跳过 findCaller 的栈回溯
+        
+        # 设置日志格式, 显式 datefmt 省去默认格式的毫秒拼接
         formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+            datefmt='%Y-%m-%dT%H:%M:%S'
         )
         
         # 文件处理器 - 按天轮转
@@ -49,13 +58,20 @@ class Logger:
             encoding='utf-8'
         )
         file_handler.setFormatter(formatter)
-        self.logger.addHandler(file_handler)
+        handlers = [file_handler]
         
         # 控制台处理器
         if console:
             console_handler = logging.StreamHandler(sys.stdout)
             console_handler.setFormatter(formatter)
-            self.logger.addHandler(console_handler)
+            handlers.append(console_handler)
+        
+        # 调用方只把日志记录放入队列, 由后台线程统一写文件和轮转, 日志 IO 不阻塞业务线程
+        log_queue = queue.SimpleQueue()
+        self.logger.addHandler(QueueHandler(log_queue))
+        self.listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.listener.stop)
     
     def debug(self, msg: str, *args, **kwargs) -> None:
         """输出调试日志"""
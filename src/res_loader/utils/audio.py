@@ -1,37 +1,62 @@
-from pathlib import Path
+import concurrent.futures
+import functools
+import os
 from typing import Optional, List
-from faster_whisper import WhisperModel
+import numpy as np
+from faster_whisper import WhisperModel, BatchedInferencePipeline, decode_audio
 from res_loader.logger import logger
 
 class AudioProcessor:
-    def __init__(self, model_size_or_path: str = "base", device: str = "cpu", compute_type: str = "int8"):
+    def __init__(self, model_size_or_path: str = "base", device: str = "cpu", compute_type: str = "int8",
+                 cpu_threads: int = 0, num_workers: int = 1, draft: bool = False):
         """
         初始化音频处理器
         
         Args:
             model_size_or_path: 模型大小，可选 "tiny", "base", "small", "medium", "large",或者指定路径
             device: 运行设备，可选 "cpu" 或 "cuda"
-            compute_type: 计算类型，可选 "int8", "float16", "float32"
+            compute_type: 计算类型，可选 "int8", "int8_float16", "int8_bfloat16", "float16", "bfloat16", "float32"
+            cpu_threads: CPU 推理线程数，0 表示使用 CTranslate2 默认值
+            num_workers: 并行转写的模型工作者数
+            draft: 草稿模式，使用贪心解码（beam_size=1, temperature=0），更快且结果确定
         """
+        self.decode_options = dict(beam_size=1, temperature=0.0) if draft else dict(beam_size=5)
         try:
             self.model = WhisperModel(
                 model_size_or_path,
                 device=device,
                 compute_type=compute_type,
+                cpu_threads=cpu_threads,
+                num_workers=num_workers,
                 download_root="models"  # 模型下载目录
             )
             logger.info(f"加载 Whisper 模型成功: {model_size_or_path}")
         except Exception as e:
             logger.error(f"加载 Whisper 模型失败: {e}")
             raise
+        self._batched_model: Optional[BatchedInferencePipeline] = None
+    
+    @property
+    def batched_model(self) -> BatchedInferencePipeline:
+        """批量推理管线, 复用已加载的模型"""
+        if self._batched_model is None:
+            self._batched_model = BatchedInferencePipeline(model=self.model)
+        return self._batched_model
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _hms(total_s: int) -> str:
+        """将整秒数格式化为 HH:MM:SS，相邻片段多落在同一秒，结果可缓存复用"""
+        h, r = divmod(total_s, 3600)
+        m, s = divmod(r, 60)
+        return f"{h:02d}:{m:02d}:{s:02d}"
     
     @staticmethod
     def format_timestamp(seconds: float) -> str:
         """将秒数格式化为 HH:MM:SS.mmm 格式"""
-        hours = int(seconds // 3600)
-        minutes = int((seconds % 3600) // 60)
-        seconds = seconds % 60
-        return f"{hours:02d}:{minutes:02d}:{seconds:06.3f}"
+        ms = round(seconds * 1000)
+        total_s, ms = divmod(ms, 1000)
+        return f"{AudioProcessor._hms(total_s)}.{ms:03d}"
     
     def audio_to_text(self, audio_path: str, language: Optional[str] = "zh") -> Optional[str]:
         """
@@ -45,8 +70,7 @@ class AudioProcessor:
             str: 转换后的文本，如果转换失败则返回None
         """
         try:
-            audio_path = Path(audio_path)
-            if not audio_path.exists():
+            if not os.path.exists(audio_path):
                 logger.error(f"音频文件不存在: {audio_path}")
                 return None
                 
@@ -54,26 +78,78 @@ class AudioProcessor:
             segments, info = self.model.transcribe(
                 str(audio_path),
                 language=language,
-                beam_size=5,
+                **self.decode_options,
                 vad_filter=True,  # 启用语音活动检测
                 vad_parameters=dict(min_silence_duration_ms=500)  # 设置静音检测参数
             )
             
-            # 合并所有片段，带时间戳
-            text_parts = []
-            for segment in segments:
-                start_time = self.format_timestamp(segment.start)
-                end_time = self.format_timestamp(segment.end)
-                text_parts.append(f"[{start_time} -> {end_time}] {segment.text}")
-            text = "\n".join(text_parts)
+            text = self._join_segments(segments)
             
             logger.info(f"音频转文本成功: {audio_path}")
-            return text.strip()
+            return text
             
         except Exception as e:
             logger.error(f"音频转文本失败 {audio_path}: {e}", exc_info=True)
             return None
     
+    def _join_segments(self, segments) -> str:
+        """合并所有片段，带时间戳"""
+        fmt = self.format_timestamp
+        return "\n".join(f"[{fmt(s.start)} -> {fmt(s.end)}] {s.text}" for s in segments).strip()
+    
+    def audio_to_text_batch(self, audio_paths: List[str], language: Optional[str] = "zh",
+                            batch_size: int = 8) -> List[Optional[str]]:
+        """
+        批量将音频文件转换为文本，使用批量推理管线将语音片段按批送入编码器
+        
+        Args:
+            audio_paths: 音频文件路径列表
+            language: 音频语言代码（如 "zh", "en"），如果为None则自动检测
+            batch_size: 每批推理的语音片段数
+            
+        Returns:
+            List[Optional[str]]: 与输入一一对应的文本，转换失败的项为None
+        """
+        texts: List[Optional[str]] = []
+        if not audio_paths:
+            return texts
+        # 解码下一个文件的同时推理当前文件，让 CPU 侧的音频解码与模型推理重叠
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as loader:
+            next_audio = loader.submit(self._load_audio, audio_paths[0])
+            for i, audio_path in enumerate(audio_paths):
+                audio = next_audio.result()
+                if i + 1 < len(audio_paths):
+                    next_audio = loader.submit(self._load_audio, audio_paths[i + 1])
+                if audio is None:
+                    texts.append(None)
+                    continue
+                try:
+                    segments, info = self.batched_model.transcribe(
+                        audio,
+                        language=language,
+                        **self.decode_options,
+                        batch_size=batch_size,
+                        vad_filter=True,
+                        vad_parameters=dict(min_silence_duration_ms=500)
+                    )
+                    texts.append(self._join_segments(segments))
+                    logger.info(f"音频转文本成功: {audio_path}")
+                except Exception as e:
+                    logger.error(f"音频转文本失败 {audio_path}: {e}", exc_info=True)
+                    texts.append(None)
+        return texts
+    
+    def _load_audio(self, audio_path: str) -> Optional[np.ndarray]:
+        """解码音频文件为模型输入的单声道波形，失败时返回None"""
+        try:
+            if not os.path.exists(audio_path):
+                logger.error(f"音频文件不存在: {audio_path}")
+                return None
+            return decode_audio(str(audio_path), sampling_rate=self.model.feature_extractor.sampling_rate)
+        except Exception as e:
+            logger.error(f"音频解码失败 {audio_path}: {e}", exc_info=True)
+            return None
+    
     def get_supported_languages(self) -> List[str]:
         """
         获取支持的语言列表
@@ -1,42 +1,275 @@
+import concurrent.futures
 import hashlib
-from pathlib import Path
-from typing import Optional
+import json
+import mmap
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
 import os
+import shutil
+import stat
+import threading
+import warnings
+from collections import OrderedDict
 from res_loader.logger import logger
 import time
 
+try:
+    from blake3 import blake3
+except ImportError:  # 未安装 blake3 时只支持 hashlib 中的算法
+    blake3 = None
+
+try:
+    import xxhash
+except ImportError:  # 未安装 xxhash 时不支持 xxh3
+    xxhash = None
+
+@dataclass
+class FileStat:
+    """文件路径与一次 stat 得到的元信息，在扫描流程中传递，避免重复 stat"""
+    __slots__ = ("path", "name", "size", "mtime_ns")
+    path: str
+    name: str
+    size: int
+    mtime_ns: int
+    
+    @classmethod
+    def from_entry(cls, entry: os.DirEntry) -> "FileStat":
+        """由 os.scandir 的目录项构造，复用其缓存的 stat 结果"""
+        st = entry.stat()
+        return cls(entry.path, entry.name, st.st_size, st.st_mtime_ns)
+    
+    @classmethod
+    def from_path(cls, path: str) -> "FileStat":
+        """对路径执行一次 stat 构造，文件不存在时抛出 OSError"""
+        st = os.stat(path)
+        return cls(path, os.path.basename(path), st.st_size, st.st_mtime_ns)
+
+
 class FileUtils:
+    # 路径 -> 最近一次确认写入完成时的 (size, mtime_ns)
+    _stable_cache: Dict[str, Tuple[int, int]] = {}
+    _STABLE_CACHE_SIZE = 65536
+    # 路径 -> (算法, mtime_ns, size, 哈希) 的 LRU 缓存, 文件未变化时重复计算直接返回
+    _hash_cache: "OrderedDict[str, Tuple[str, int, int, str]]" = OrderedDict()
+    _HASH_CACHE_SIZE = 4096
+    _hash_cache_lock = threading.Lock()
+    # 不超过该大小的文件一次读入内存计算哈希
+    _SMALL_FILE_SIZE = 64 * 1024
+    # 保存哈希的扩展属性名前缀
+    _XATTR_PREFIX = "user.res_loader."
+    
     @staticmethod
-    def get_file_md5(file_path: str, chunk_size: int = 8192) -> Optional[str]:
+    def get_file_md5(file_path: str, chunk_size: int = 1 << 20) -> Optional[str]:
         """
         计算文件的MD5值
         
+        已废弃，请使用 get_file_hash 并通过 algo 指定算法。
+        
         Args:
             file_path: 文件路径
-            chunk_size: 每次读取的块大小，默认8KB
+            chunk_size: 无法 mmap 时分块读取的缓冲区大小，缓冲区在读取过程中复用
             
         Returns:
             文件的MD5值，如果文件不存在或读取失败则返回None
         """
+        warnings.warn("get_file_md5 已废弃，请使用 get_file_hash", DeprecationWarning, stacklevel=2)
+        return FileUtils.get_file_hash(file_path, algo="md5", chunk_size=chunk_size)
+    
+    @staticmethod
+    def io_workers() -> int:
+        """读取并哈希文件的线程数：核数的 4 倍，最多 32 个，使磁盘请求队列保持一定深度"""
+        return min(32, 4 * (os.cpu_count() or 1))
+    
+    @staticmethod
+    def md5_many(file_paths: List[str], max_workers: Optional[int] = None) -> List[Optional[str]]:
+        """
+        批量计算多个文件的MD5值
+        
+        每个文件由一个线程映射后通过单次 update 送入哈希，hashlib 对 2KB 以上的数据在整个 update
+        期间释放 GIL，因此多个文件真正在多个核心上并行计算，而不会被逐块循环的解释器开销串行化。
+        大量小文件时瓶颈在 IO 延迟，线程数超过核数以保持足够的并发读请求。
+        
+        Args:
+            file_paths: 文件路径列表
+            max_workers: 并行线程数，默认为 io_workers()
+            
+        Returns:
+            与输入一一对应的MD5值，读取失败的项为None
+        """
+        if not file_paths:
+            return []
+        workers = min(len(file_paths), max_workers or FileUtils.io_workers())
+        if workers == 1:
+            return [FileUtils.get_file_hash(path) for path in file_paths]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(FileUtils.get_file_hash, file_paths))
+    
+    @staticmethod
+    def get_file_hash(file_path: str, algo: str = "md5", chunk_size: int = 1 << 20,
+                      xattr_cache: bool = False) -> Optional[str]:
+        """
+        计算文件的哈希值
+        
+        Args:
+            file_path: 文件路径
+            algo: 哈希算法，可选 "md5", "sha256", "blake3"（需安装 blake3，使用 SIMD 多线程计算），
+                "xxh3"（需安装 xxhash，128 位 XXH3，非加密哈希，仅用于去重时速度最快）
+            chunk_size: 无法 mmap 时分块读取的缓冲区大小
+            xattr_cache: 是否将结果保存到文件的扩展属性（user.res_loader.<算法>.v1），重启后或其他进程可直接复用，
+                仅 Linux 等支持 xattr 的文件系统有效
+            
+        Returns:
+            文件哈希的十六进制字符串，如果文件不存在或读取失败则返回None
+        
+        结果按 (路径, 算法, mtime_ns, size) 缓存，原地覆盖文件且保持修改时间不变的调用方需调用 invalidate_md5。
+        
+        md5/sha256 对单个文件只能串行计算；GB 级音视频文件的哈希成为瓶颈时应改用 blake3，
+        其树形结构可将同一个文件分片到多个核心上并行计算。
+        """
         try:
-            file_path = Path(file_path)
-            if not file_path.exists():
+            # 一次 stat 同时完成存在性、文件类型检查并提供缓存键
+            key = os.fspath(file_path)
+            try:
+                st = os.stat(key)
+            except FileNotFoundError:
                 logger.error(f"文件不存在: {file_path}")
                 return None
-                
-            if not file_path.is_file():
+            if not stat.S_ISREG(st.st_mode):
                 logger.error(f"路径不是文件: {file_path}")
                 return None
-                
-            md5_hash = hashlib.md5()
-            with open(file_path, 'rb') as f:
-                while chunk := f.read(chunk_size):
-                    md5_hash.update(chunk)
-                    
-            return md5_hash.hexdigest()
+            
+            with FileUtils._hash_cache_lock:
+                cached = FileUtils._hash_cache.get(key)
+                if cached is not None and cached[:3] == (algo, st.st_mtime_ns, st.st_size):
+                    FileUtils._hash_cache.move_to_end(key)
+                    return cached[3]
+            digest = FileUtils._read_xattr_hash(key, algo, st) if xattr_cache else None
+            if digest is None:
+                digest = FileUtils._compute_hash(key, algo, chunk_size, st.st_size)
+                if digest is not None and xattr_cache:
+                    FileUtils._write_xattr_hash(key, algo, st, digest)
+            if digest is not None:
+                with FileUtils._hash_cache_lock:
+                    FileUtils._hash_cache[key] = (algo, st.st_mtime_ns, st.st_size, digest)
+                    FileUtils._hash_cache.move_to_end(key)
+                    if len(FileUtils._hash_cache) > FileUtils._HASH_CACHE_SIZE:
+                        FileUtils._hash_cache.popitem(last=False)
+            return digest
         except Exception as e:
-            logger.error(f"计算文件MD5失败: {e}")
+            logger.error(f"计算文件哈希失败 {file_path} ({algo}): {e}")
+            return None
+    
+    @staticmethod
+    def invalidate_md5(file_path: str) -> None:
+        """使指定文件的哈希缓存失效，包括保存在扩展属性中的结果"""
+        with FileUtils._hash_cache_lock:
+            FileUtils._hash_cache.pop(str(file_path), None)
+        if hasattr(os, "listxattr"):
+            try:
+                for name in os.listxattr(file_path):
+                    if name.startswith(FileUtils._XATTR_PREFIX):
+                        os.removexattr(file_path, name)
+            except OSError:
+                pass
+    
+    @staticmethod
+    def _read_xattr_hash(file_path: str, algo: str, st: os.stat_result) -> Optional[str]:
+        """读取扩展属性中保存的哈希，文件大小或修改时间不一致时视为失效"""
+        if not hasattr(os, "getxattr"):
             return None
+        try:
+            cached = json.loads(os.getxattr(file_path, f"{FileUtils._XATTR_PREFIX}{algo}.v1"))
+        except (OSError, ValueError):
+            # 未保存、文件系统不支持或内容损坏
+            return None
+        if cached.get("mtime_ns") == st.st_mtime_ns and cached.get("size") == st.st_size:
+            return cached.get("hash")
+        return None
+    
+    @staticmethod
+    def _write_xattr_hash(file_path: str, algo: str, st: os.stat_result, digest: str) -> None:
+        """将哈希保存到扩展属性，设置扩展属性不会修改文件的 mtime"""
+        if not hasattr(os, "setxattr"):
+            return
+        value = json.dumps({"mtime_ns": st.st_mtime_ns, "size": st.st_size, "hash": digest})
+        try:
+            os.setxattr(file_path, f"{FileUtils._XATTR_PREFIX}{algo}.v1", value.encode())
+        except OSError:
+            # 文件系统不支持或无写权限
+            pass
+    
+    @staticmethod
+    def _compute_hash(file_path: str, algo: str, chunk_size: int, size: Optional[int] = None) -> Optional[str]:
+        """读取文件并计算哈希，不使用缓存，异常由调用方处理"""
+        if algo == "blake3":
+            if blake3 is None:
+                logger.error("未安装 blake3，无法计算 blake3 哈希")
+                return None
+            hasher = blake3(max_threads=blake3.AUTO)
+            hasher.update_mmap(str(file_path))
+            return hasher.hexdigest()
+        
+        if algo == "xxh3":
+            if xxhash is None:
+                logger.error("未安装 xxhash，无法计算 xxh3 哈希")
+                return None
+            hasher = xxhash.xxh3_128()
+        else:
+            hasher = hashlib.new(algo)
+        with open(file_path, 'rb') as f:
+            # 小文件的开销主要在系统调用上, 一次读入后直接计算, 省去预读提示与 mmap/madvise
+            if size is not None and size <= FileUtils._SMALL_FILE_SIZE:
+                hasher.update(f.read())
+                return hasher.hexdigest()
+            FileUtils._advise_sequential(f.fileno())
+            # 空文件无法 mmap, 也无需读取
+            if os.fstat(f.fileno()).st_size:
+                FileUtils._update_hasher(hasher, f, chunk_size)
+                
+        return hasher.hexdigest()
+    
+    @staticmethod
+    def _update_hasher(hasher, f, chunk_size: int = 1 << 20) -> None:
+        """
+        将已打开文件的全部内容送入哈希
+        
+        优先整个文件映射后一次送入，避免逐块读取的解释器开销；
+        无法 mmap 时（如不支持的平台或特殊文件）退回复用同一缓冲区的大块读取。
+        """
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                FileUtils._advise_mmap_sequential(mm)
+                hasher.update(mm)
+            return
+        except (OSError, ValueError):
+            pass
+        buf = memoryview(bytearray(chunk_size))
+        f.seek(0)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            hasher.update(buf[:n])
+    
+    @staticmethod
+    def _advise_mmap_sequential(mm: mmap.mmap) -> None:
+        """提示内核映射区域将被顺序访问，缺页时加大预读并尽早回收已读页面（仅支持 madvise 的系统）"""
+        for advice in ("MADV_SEQUENTIAL", "MADV_WILLNEED"):
+            if hasattr(mmap, advice):
+                try:
+                    mm.madvise(getattr(mmap, advice))
+                except OSError:
+                    pass
+    
+    @staticmethod
+    def _advise_sequential(fd: int) -> None:
+        """提示内核将顺序读取整个文件，提前预读（仅 POSIX 系统）"""
+        if hasattr(os, "posix_fadvise"):
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            except OSError:
+                pass
     
     @staticmethod
     def get_file_size(file_path: str) -> Optional[int]:
@@ -49,12 +282,98 @@ class FileUtils:
         Returns:
             文件大小（字节），如果文件不存在则返回None
         """
+        st = FileUtils.stat_or_none(file_path)
+        if st is None:
+            logger.error(f"获取文件大小失败: {file_path}")
+            return None
+        return st.st_size
+    
+    @staticmethod
+    def stat_or_none(file_path: str) -> Optional[os.stat_result]:
+        """
+        获取文件的 stat 结果，路径不存在或无法访问时返回None
+        
+        既要判断存在又要使用大小、修改时间等信息的调用方应直接使用该结果，只需一次系统调用。
+        """
         try:
-            return os.path.getsize(file_path)
-        except Exception as e:
-            logger.error(f"获取文件大小失败: {e}")
+            return os.stat(file_path)
+        except (OSError, ValueError):
             return None
     
+    @staticmethod
+    def stat_directory(dir_path: str) -> Dict[str, Tuple[int, int]]:
+        """
+        批量获取目录下（不递归）普通文件的大小与修改时间
+        
+        os.scandir 读取目录时已得到文件类型，DirEntry 的 stat 结果会被缓存，
+        相比逐个调用 get_file_size 减少系统调用。
+        
+        Args:
+            dir_path: 目录路径
+            
+        Returns:
+            文件名 -> (size, mtime_ns)，目录无法读取时返回空字典
+        """
+        stats: Dict[str, Tuple[int, int]] = {}
+        try:
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            st = entry.stat()
+                            stats[entry.name] = (st.st_size, st.st_mtime_ns)
+                    except OSError:
+                        # 遍历期间被删除的文件
+                        continue
+        except OSError as e:
+            logger.error(f"读取目录失败 {dir_path}: {e}")
+        return stats
+    
+    @staticmethod
+    def copy_fast(src: str, dst: str, chunk_size: int = 1 << 20) -> bool:
+        """
+        复制文件内容，不经过用户态缓冲区
+        
+        Linux 上使用 copy_file_range 由内核直接复制（同一文件系统上还可能是写时复制的引用）；
+        不支持时退回复用缓冲区的分块复制。
+        
+        Args:
+            src: 源文件路径
+            dst: 目标文件路径，已存在时覆盖
+            chunk_size: 退回分块复制时的缓冲区大小
+            
+        Returns:
+            是否成功
+            
+        Raises:
+            shutil.SameFileError: 源与目标为同一文件，以写方式打开目标会先截断源文件
+        """
+        try:
+            same = os.path.samefile(src, dst)
+        except OSError:
+            same = False
+        if same:
+            raise shutil.SameFileError(f"{src!r} 与 {dst!r} 是同一个文件")
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                if hasattr(os, "copy_file_range"):
+                    try:
+                        size = os.fstat(fsrc.fileno()).st_size
+                        # 以文件长度为上限循环，直到源文件读尽
+                        while os.copy_file_range(fsrc.fileno(), fdst.fileno(), max(size, chunk_size)):
+                            pass
+                        return True
+                    except OSError:
+                        # 内核或文件系统不支持（如旧内核跨文件系统复制），从头改用普通复制
+                        fsrc.seek(0)
+                        fdst.seek(0)
+                        fdst.truncate()
+                shutil.copyfileobj(fsrc, fdst, chunk_size)
+            return True
+        except Exception as e:
+            logger.error(f"复制文件失败 {src} -> {dst}: {e}")
+            return False
+    
     @staticmethod
     def ensure_dir(directory: str) -> bool:
         """
@@ -74,11 +393,37 @@ class FileUtils:
             return False 
     
     @staticmethod
-    def get_file_type(file_path: str) -> Optional[str]:
+    def read_text(file_path: str, encoding: str = "utf-8", mmap_threshold: int = 1 << 20,
+                  size: Optional[int] = None) -> str:
+        """
+        读取文本文件内容
+        
+        Args:
+            file_path: 文件路径
+            encoding: 文件编码
+            mmap_threshold: 超过该大小（字节）的文件通过 mmap 映射后一次性解码，换行符同样统一为 \n
+            size: 调用方已知的文件大小，传入时不再重复 stat
+            
+        Returns:
+            文件文本内容
+        """
+        if size is None:
+            size = os.path.getsize(file_path)
+        if size <= mmap_threshold:
+            with open(file_path, encoding=encoding) as f:
+                return f.read()
+        with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # 与文本模式读取一致, 统一换行符为 \n, 保存的内容不随文件大小而变化
+            return str(mm, encoding).replace("\r\n", "\n").replace("\r", "\n")
+    
+    @staticmethod
+    def get_file_type(file_path: str) -> str:
         """
-        获取文件类型
+        获取文件类型（小写扩展名，不含点号，无扩展名时为空字符串）
+        
+        只取最后一个路径分量的扩展名，目录名中的点号与以点号开头的隐藏文件（如 .bashrc）不会被误判。
         """
-        return file_path.split(".")[-1]
+        return os.path.splitext(file_path)[1][1:].lower()
 
     @staticmethod
     def get_file_name(file_path: str) -> Optional[str]:
@@ -90,15 +435,20 @@ class FileUtils:
     @staticmethod
     def file_exists(file_path: str) -> bool:
         """
-        判断文件是否存在
+        判断文件是否存在（目录同样返回True，需要区分时使用 stat_or_none 检查 st_mode）
         """
-        return os.path.exists(file_path)
+        return FileUtils.stat_or_none(file_path) is not None
     
     @staticmethod
-    def is_write_completed(file_path: str, check_interval: float = 0.1, max_checks: int = 2) -> bool:
+    def is_write_completed(file_path: str, check_interval: float = 0.05, max_checks: int = 2) -> bool:
         """
         检查文件是否写入完成
         
+        两次采样之间文件大小与修改时间均未变化即认为写入完成。需要等待时只打开文件一次，
+        之后对文件描述符 fstat 采样，不再重复解析路径。
+        稳定时的 (size, mtime_ns) 会被缓存，文件未再变化时重复检查直接返回，无需再次等待；
+        收到写入方关闭文件的事件时由 mark_write_completed 预先写入缓存，无需轮询。
+        
         Args:
             file_path: 文件路径
             check_interval: 检查间隔（秒）
@@ -107,37 +457,55 @@ class FileUtils:
         Returns:
             bool: 文件是否写入完成
         """
+        key = str(file_path)
         try:
-            file_path = Path(file_path)
-            if not file_path.exists():
-                return False
-                
-            # 获取初始文件大小
-            initial_size = file_path.stat().st_size
+            st = os.stat(key)
+            signature = (st.st_size, st.st_mtime_ns)
+            if FileUtils._stable_cache.get(key) == signature:
+                return True
             
-            # 检查文件大小是否稳定
-            for _ in range(max_checks):
-                time.sleep(check_interval)
-                current_size = file_path.stat().st_size
-                
-                # 如果文件大小没有变化，且文件可读，则认为写入完成
-                if current_size == initial_size:
-                    try:
-                        # 尝试打开文件进行读取
-                        with open(file_path, 'rb') as f:
-                            f.read(1)  # 尝试读取一个字节
+            # 检查文件大小与修改时间是否稳定
+            fd = os.open(key, os.O_RDONLY)
+            try:
+                for _ in range(max_checks):
+                    time.sleep(check_interval)
+                    st = os.fstat(fd)
+                    current = (st.st_size, st.st_mtime_ns)
+                    if current == signature:
+                        FileUtils._remember_stable(key, current)
                         return True
-                    except IOError:
-                        continue
-                
-                initial_size = current_size
+                    signature = current
+            finally:
+                os.close(fd)
                 
             return False
             
+        except FileNotFoundError:
+            return False
         except Exception as e:
             logger.error(f"检查文件写入状态失败 {file_path}: {e}")
             return False
     
+    @staticmethod
+    def mark_write_completed(file_path: str) -> None:
+        """
+        记录文件已写入完成，用于 inotify 的 IN_CLOSE_WRITE 等写入方关闭文件的事件，
+        之后文件未变化时 is_write_completed 直接返回 True
+        """
+        key = str(file_path)
+        try:
+            st = os.stat(key)
+        except OSError:
+            return
+        FileUtils._remember_stable(key, (st.st_size, st.st_mtime_ns))
+    
+    @staticmethod
+    def _remember_stable(key: str, signature: Tuple[int, int]) -> None:
+        """缓存写入完成时的 (size, mtime_ns)，超出容量时整体清空"""
+        if len(FileUtils._stable_cache) >= FileUtils._STABLE_CACHE_SIZE:
+            FileUtils._stable_cache.clear()
+        FileUtils._stable_cache[key] = signature
+    
     
     
 
@@ -1,18 +1,27 @@
+import concurrent.futures
+import shutil
 import subprocess
-from pathlib import Path
-from typing import Optional
+import tempfile
+import threading
+from typing import IO, Any, Dict, List, Optional, Tuple
 import os
 from res_loader.logger import logger
 
+# 只输出错误信息, 成功时标准错误几乎为空
+QUIET_ARGS = ('-hide_banner', '-loglevel', 'error')
+
+
 class VideoProcessor:
-    def __init__(self, ffmpeg_path: str):
+    def __init__(self, ffmpeg_path: str, workers: Optional[int] = None):
         """
         初始化视频处理器
         
         Args:
             ffmpeg_path: ffmpeg可执行文件的路径
+            workers: video_to_audio_many 同时运行的 ffmpeg 进程数，为空时取 CPU 核数的一半
         """
         self.ffmpeg_path = ffmpeg_path
+        self.workers = workers or max(1, (os.cpu_count() or 1) // 2)
     
     def video_to_audio(self, video_path: str, output_path: Optional[str] = None) -> bool:
         """
@@ -25,13 +34,12 @@ class VideoProcessor:
         Returns:
             输出音频文件路径
         """
-        video_path = Path(video_path)
-        if not video_path.exists():
+        if not os.path.exists(video_path):
             logger.error(f"视频文件不存在: {video_path}")
             return False
             
         if output_path is None:
-            output_path = str(video_path.with_suffix('.mp3'))
+            output_path = os.path.splitext(video_path)[0] + '.mp3'
         
         parent_dir = os.path.dirname(output_path)
         if parent_dir:
@@ -40,22 +48,162 @@ class VideoProcessor:
         # 构建ffmpeg命令
         cmd = [
             self.ffmpeg_path,
+            *QUIET_ARGS, '-nostdin',
             '-i', str(video_path),
-            '-vn',  # 不处理视频
-            '-acodec', 'libmp3lame',  # 使用MP3编码
-            '-ab', '192k',  # 音频比特率
-            '-ar', '44100',  # 采样率
             '-y',  # 覆盖已存在的文件
-            output_path
+            *self._audio_output_args({"path": output_path})
         ]
+        return self._run(cmd)
+    
+    def video_to_audio_many(self, jobs: List[Tuple[str, str]]) -> List[bool]:
+        """
+        并行转换多个视频，多核机器上同时运行多个 ffmpeg 进程
+        
+        ffmpeg 为外部进程，线程只负责等待，等待期间不占用 GIL，无需进程池。
         
+        Args:
+            jobs: (输入视频路径, 输出音频路径) 列表
+            
+        Returns:
+            与输入一一对应的转换结果，单个任务出错只使该项为 False
+        """
+        if not jobs:
+            return []
+        workers = min(len(jobs), self.workers)
+        if workers == 1:
+            return [self._safe_video_to_audio(job) for job in jobs]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self._safe_video_to_audio, jobs))
+    
+    def _safe_video_to_audio(self, job: Tuple[str, str]) -> bool:
+        """执行单个转换任务，异常时记录日志并返回 False，不影响同批次的其他任务"""
+        video_path, output_path = job
         try:
-            # 执行ffmpeg命令
-            subprocess.run(cmd, check=True, capture_output=True)
+            return self.video_to_audio(video_path, output_path)
+        except Exception as e:
+            logger.error(f"视频转换为音频失败 {video_path}: {e}")
+            return False
+    
+    def video_to_audio_multi(self, video_path: str, outputs: List[Dict[str, Any]]) -> bool:
+        """
+        一次 ffmpeg 调用生成多个音频文件，视频只解码一次
+        
+        Args:
+            video_path: 输入视频文件路径
+            outputs: 输出参数列表，每项包含 path，可选 codec（默认 libmp3lame）、
+                bitrate（默认 192k）、sample_rate（默认 44100）、format（容器格式，默认按扩展名推断）
+            
+        Returns:
+            是否全部转换成功
+        """
+        if not outputs:
             return True
-        except subprocess.CalledProcessError as e:
-            logger.error(f"视频转换失败: {e.stderr.decode()}")
+        if not os.path.isfile(video_path):
+            logger.error(f"视频文件不存在: {video_path}")
             return False
+        
+        cmd = [self.ffmpeg_path, *QUIET_ARGS, '-nostdin', '-i', str(video_path), '-y']
+        for output in outputs:
+            parent_dir = os.path.dirname(output["path"])
+            if parent_dir:
+                os.makedirs(parent_dir, exist_ok=True)
+            cmd.extend(self._audio_output_args(output))
+        return self._run(cmd)
+    
+    def video_to_audio_stream(self, video_reader: IO[bytes], audio_writer: IO[bytes],
+                              chunk_size: int = 1 << 20) -> bool:
+        """
+        通过管道将视频流转换为 MP3 音频流，输入输出都不经过磁盘
+        
+        输入由后台线程写入 ffmpeg 的标准输入，当前线程将标准输出写入 audio_writer，
+        下载与转码可以同时进行。moov 位于文件末尾的 MP4 无法从管道读取，需先落盘后使用 video_to_audio。
+        
+        Args:
+            video_reader: 视频字节流
+            audio_writer: 接收 MP3 字节流
+            chunk_size: 管道读写的块大小
+            
+        Returns:
+            是否转换成功
+        """
+        cmd = [
+            self.ffmpeg_path,
+            *QUIET_ARGS,
+            '-i', 'pipe:0',
+            *self._audio_output_args({"path": 'pipe:1', "format": 'mp3'})
+        ]
+        # 标准错误写入临时文件, 无需额外线程持续读取管道
+        stderr = tempfile.TemporaryFile()
+        try:
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr)
         except Exception as e:
-            logger.error(f"视频转换过程中发生错误: {str(e)}")
+            stderr.close()
+            logger.error(f"启动 ffmpeg 失败: {str(e)}")
             return False
+        
+        def feed_input():
+            try:
+                shutil.copyfileobj(video_reader, proc.stdin, chunk_size)
+            except (BrokenPipeError, ValueError):
+                # ffmpeg 提前退出, 错误信息由标准错误输出记录
+                pass
+            except Exception as e:
+                logger.error(f"写入视频流失败: {str(e)}")
+            finally:
+                try:
+                    proc.stdin.close()
+                except BrokenPipeError:
+                    pass
+        
+        feeder = threading.Thread(target=feed_input, daemon=True)
+        feeder.start()
+        with stderr:
+            try:
+                shutil.copyfileobj(proc.stdout, audio_writer, chunk_size)
+            except Exception as e:
+                logger.error(f"写出音频流失败: {str(e)}")
+                proc.kill()
+            finally:
+                proc.stdout.close()
+                returncode = proc.wait()
+                feeder.join()
+            if returncode != 0:
+                logger.error(f"视频转换失败: {self._read_stderr(stderr)}")
+                return False
+        return True
+    
+    @staticmethod
+    def _audio_output_args(output: Dict[str, Any]) -> List[str]:
+        """单个音频输出的 ffmpeg 参数, 追加在输入之后"""
+        return [
+            '-vn',  # 不处理视频
+            '-acodec', output.get("codec", 'libmp3lame'),  # 默认使用MP3编码
+            '-ab', str(output.get("bitrate", '192k')),  # 音频比特率
+            '-ar', str(output.get("sample_rate", 44100)),  # 采样率
+            '-threads', '0',  # 由 ffmpeg 按核数自动选择线程数
+            *(['-f', output["format"]] if output.get("format") else []),
+            str(output["path"])
+        ]
+    
+    @staticmethod
+    def _run(cmd: List[str]) -> bool:
+        """执行 ffmpeg 命令, 失败时记录错误输出"""
+        # 标准错误写入临时文件而非内存管道, 只在失败时读取
+        with tempfile.TemporaryFile() as stderr:
+            try:
+                # 执行ffmpeg命令
+                subprocess.run(cmd, check=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=stderr)
+                return True
+            except subprocess.CalledProcessError:
+                logger.error(f"视频转换失败: {VideoProcessor._read_stderr(stderr)}")
+                return False
+            except Exception as e:
+                logger.error(f"视频转换过程中发生错误: {str(e)}")
+                return False
+    
+    @staticmethod
+    def _read_stderr(stderr: IO[bytes], limit: int = 65536) -> str:
+        """读取 ffmpeg 标准错误的末尾部分"""
+        size = stderr.seek(0, os.SEEK_END)
+        stderr.seek(max(0, size - limit))
+        return stderr.read().decode(errors='replace')